@@ -8,9 +8,22 @@
 #
 # v0.1, 2026-02-23  initial draught.
 # v0.2, 2026-02-25  prints nice bars.
+# v0.3, 2026-10-18  counters kept incrementally in a ring of time slices, no object per event.
+# v0.4, 2026-10-18  fast parser: block reads, columns from the header, bisect buckets, TIME(s) as clock. --bench.
+# v0.5, 2026-10-18  log2 latency histograms per size bucket, p50/p99 shown. New --by disk|comm|pid with top lists.
+# v0.6, 2026-10-18  new --record FILE: JSON lines time series. New --replay CAPTURE with --speed, new --diff A B.
+# v0.7, 2026-10-18  new --ebpf: own BCC collector, histograms aggregated in the kernel, maps read per interval.
+#                   --fake_bpf CAPTURE tests it without root.
+#
+# With --ebpf, python3-bpfcc (BCC) is needed, and root:
+#   sudo apt install python3-bpfcc
+#   sudo biosnoop-sizes.py --ebpf
+
+import os, sys, time, argparse, json, threading
+from bisect import bisect_right
+from collections import namedtuple
 
-import os, sys, time
-from collections import deque       # list.pop(0) is O(n). deque.popleft() is O(1)
+__version__ = '0.7'
 
 update_interval = 0.5   # seconds
 time_window = 10.0      # seconds
@@ -18,71 +31,580 @@ time_window = 10.0      # seconds
 bucket_sizes = [  4*1024, 16*1024, 64*1024, 256*1024, 1024*1024, 2*1024*1024, 4*1024*1024, 16*1024*1024, 64*1024*1024, 256*1024*1024 ]
 bucket_names = ['<4k',  '<16k',  '<64k',  '<256k',  '<1M',     '<2M',       '<4M',       '<16M',       '<64M',       '<256M', '...' ]
 def bucket(n):
-    for i in range(len(bucket_sizes)):
-        if n < bucket_sizes[i]:
-            return i
-    return len(bucket_sizes)
-
-
-def print_stats(q):
-    # for all buckets, increment
-    r_counters = [0] * len(bucket_names)
-    w_counters = [0] * len(bucket_names)
-    for i in q:
-        if i[1] == 'R':
-            r_counters[i[2]] += 1
-        else:
-            w_counters[i[2]] += 1
-    # print(r_counters, w_counters)
+    return bisect_right(bucket_sizes, n)
+
+lat_buckets = 24        # log2 of microseconds: bucket k holds latencies below 2**k us, the last one all above.
+def lat_bucket(ms):
+    return min(int(ms * 1000).bit_length(), lat_buckets - 1)
+
+
+def percentile(h, p):
+    # upper bound in ms of the latency bucket, that holds the percentile p of histogram h. None if empty.
+    n = sum(h)
+    if not n:
+        return None
+    acc = 0
+    for k, c in enumerate(h):
+        acc += c
+        if acc >= p * n:
+            return (1 << k) / 1000.0
+
+
+def fmt_ms(ms):
+    return '-' if ms is None else '%g' % ms
+
+
+class Window:
+    """ Counters per bucket of the last time_window seconds, for R and W, and a log2 latency histogram
+        for each of them. Kept as a ring of slices of update_interval seconds, each with its own
+        counters, and the sums over the ring. An event increments the current slice and the sums,
+        a slice leaving the window is subtracted once. Neither adding nor printing depends on the
+        number of events in the window.
+        Events with a group (--by) also count into {group: [count, bytes, latency histogram]}.
+        A group without events in the window is dropped. At most max_groups are kept, events of
+        further groups count as b'other'.
+        on_slice(start, slice) is called with each slice when it is complete, for --record.
+    """
+    on_slice = None
+
+    def __init__(self, width, slice_len, nbuckets, max_groups=1000):
+        self.n = max(1, int(round(width / slice_len)))
+        self.slice_len = slice_len
+        self.nbuckets = nbuckets
+        self.max_groups = max_groups
+        self.ring = [self._zero() for _ in range(self.n)]
+        self.r, self.w, self.lat, self.groups = self._zero()
+        self.sums = (self.r, self.w)
+        self.slice = None           # number of the current slice, int(t / slice_len)
+        self.next_t = 0.0           # start of the next slice
+
+    def _zero(self):
+        # (R counts, W counts, latency histograms, groups). The histograms are one flat list, see hist().
+        nb = self.nbuckets
+        return [0] * nb, [0] * nb, [0] * (2 * nb * lat_buckets), {}
+
+    def hist(self, rw, b):
+        # the latency histogram of R (rw 0) or W (rw 1) in size bucket b.
+        i = (rw * self.nbuckets + b) * lat_buckets
+        return self.lat[i:i+lat_buckets]
+
+    def advance(self, now):
+        s = int(now / self.slice_len)
+        if self.slice is None:
+            self.slice = s
+        if s > self.slice and self.on_slice:
+            self.on_slice(self.slice * self.slice_len, self.ring[self.slice % self.n])
+        # the slices that are reused now leave the window. After a long pause, that is all of them.
+        for k in range(self.slice + 1, min(s, self.slice + self.n) + 1):
+            r, w, lat, groups = self.ring[k % self.n]
+            for b in range(self.nbuckets):
+                self.r[b] -= r[b]
+                self.w[b] -= w[b]
+                r[b] = w[b] = 0
+            t = self.lat
+            for i, c in enumerate(lat):
+                if c:
+                    t[i] -= c
+                    lat[i] = 0
+            for g, (count, nbytes, h) in groups.items():
+                t = self.groups[g]
+                t[0] -= count
+                t[1] -= nbytes
+                for l in range(lat_buckets):
+                    t[2][l] -= h[l]
+                if not t[0]:
+                    del self.groups[g]
+            groups.clear()
+        self.slice = max(s, self.slice)
+        self.next_t = (self.slice + 1) * self.slice_len
+
+    def flush(self):
+        # at the end of the input, the current slice is complete, too.
+        if self.on_slice and self.slice is not None:
+            self.on_slice(self.slice * self.slice_len, self.ring[self.slice % self.n])
+
+    def add_many(self, now, rw, b, lb, n):
+        # n events at once, from the kernel maps of --ebpf. Like add(), without groups.
+        if now >= self.next_t:
+            self.advance(now)
+        sl = self.ring[self.slice % self.n]
+        sl[rw][b] += n
+        self.sums[rw][b] += n
+        i = (rw * self.nbuckets + b) * lat_buckets + lb
+        sl[2][i] += n
+        self.lat[i] += n
+
+    def add(self, now, rw, b, lb, nbytes=0, group=None):
+        # rw is 0 for R, 1 for W. b is the size bucket, lb the latency bucket.
+        if now >= self.next_t:
+            self.advance(now)
+        sl = self.ring[self.slice % self.n]
+        sl[rw][b] += 1
+        self.sums[rw][b] += 1
+        i = (rw * self.nbuckets + b) * lat_buckets + lb
+        sl[2][i] += 1
+        self.lat[i] += 1
+        if group is not None:
+            if group not in self.groups and len(self.groups) >= self.max_groups:
+                group = b'other'
+            for groups in (sl[3], self.groups):
+                g = groups.get(group)
+                if g is None:
+                    g = groups[group] = [0, 0, [0] * lat_buckets]
+                g[0] += 1
+                g[1] += nbytes
+                g[2][lb] += 1
+
+    def top(self, n):
+        """ Two lists of (group, count, bytes, p99 ms), the n groups with the most bytes, and the n with the highest p99 latency. """
+        rows = [(g.decode(errors='replace'), c, nbytes, percentile(h, 0.99)) for g, (c, nbytes, h) in self.groups.items()]
+        return sorted(rows, key=lambda r: -r[2])[:n], sorted(rows, key=lambda r: -r[3])[:n]
+
+
+def top_lines(win, n):
+    lines = []
+    by_bytes, by_p99 = win.top(n)
+    for title, rows in (("top %d by bytes" % n, by_bytes), ("top %d by p99 latency" % n, by_p99)):
+        lines.append("%-30s %10s %8s %8s" % (title, 'MB', 'count', 'p99 ms'))
+        for g, count, nbytes, p99 in rows:
+            lines.append("  %-28.28s %10.1f %8d %8s" % (g, nbytes / 1e6, count, fmt_ms(p99)))
+        lines += [''] * (n - len(rows))
+    return lines
+
+
+def print_stats(win):
+    r_counters = win.r
+    w_counters = win.w
 
     cols, lines = os.get_terminal_size()
-    bar_width = cols - 20
+    bar_width = cols - 38
     maxval = max(r_counters + w_counters + [ bar_width ])
 
+    print("\x1b[K%5s   %7s %8s %8s" % ("size", "count", "p50 ms", "p99 ms"))
     for i in range(len(bucket_names)):
-      print("\x1b[K%5s R %7d %s" % (bucket_names[i], r_counters[i],  "=" * int(r_counters[i] * bar_width / maxval)))
-      print("\x1b[K%5s W %7d %s" % (             "", w_counters[i],  "#" * int(w_counters[i] * bar_width / maxval)))
+        print("\x1b[K%5s R %7d %8s %8s %s" % (bucket_names[i], r_counters[i], fmt_ms(percentile(win.hist(0, i), 0.5)), fmt_ms(percentile(win.hist(0, i), 0.99)),
+                                            "=" * int(r_counters[i] * bar_width / maxval)))
+        print("\x1b[K%5s W %7d %8s %8s %s" % (             "", w_counters[i], fmt_ms(percentile(win.hist(1, i), 0.5)), fmt_ms(percentile(win.hist(1, i), 0.99)),
+                                            "#" * int(w_counters[i] * bar_width / maxval)))
+    n = 1 + 2*len(bucket_names)
+    if args.by:
+        for line in top_lines(win, args.top):
+            print("\x1b[K" + line)
+            n += 1
     sys.stdout.flush()
-    sys.stdout.write("\x1b[%dA" % 2*len(bucket_names))     # move cursor up again
+    sys.stdout.write("\x1b[%dA" % n)     # move cursor up again
     sys.stdout.flush()
 
 
-printed_tstamp = 0.0
+class Recorder:
+    """ --record FILE: one JSON line per time slice with events, after a header line. Each has the start
+        time "t" (of the TIME(s) clock), the counts per size bucket "R" and "W", the non-empty latency
+        histograms "lat" as {"R<4k": [...], ...}, and with --by the "groups" as {group: [count, bytes, [...]]}.
+        The slices do not overlap, sums over them are the histograms of any period.
+    """
+    def __init__(self, path, by):
+        self.o = open(path, 'w')
+        self.o.write(json.dumps({'biosnoop-sizes': __version__, 'slice_s': update_interval, 'buckets': bucket_names,
+                                 'lat_buckets_us': [1 << k for k in range(lat_buckets)], 'by': by}) + '\n')
 
-if sys.stdin.isatty():
-  print("Usage:\n\t sudo python -u biosnoop.py | " + sys.argv[0])
-  sys.exit(0)
+    def slice(self, t, sl):
+        r, w, lat, groups = sl
+        if not any(r) and not any(w):
+            return
+        rec = {'t': round(t, 6), 'R': r, 'W': w, 'lat': {}}
+        for rw, name in ((0, 'R'), (1, 'W')):
+            for b in range(len(bucket_names)):
+                i = (rw * len(bucket_names) + b) * lat_buckets
+                if any(lat[i:i+lat_buckets]):
+                    rec['lat'][name + bucket_names[b]] = lat[i:i+lat_buckets]
+        if groups:
+            rec['groups'] = {g.decode(errors='replace'): v for g, v in groups.items()}
+        self.o.write(json.dumps(rec, separators=(',', ':')) + '\n')
 
-queue = deque()
+    def close(self):
+        self.o.close()
 
-printcount = 0
-for raw in sys.stdin:
-    line = raw.split()
-    if len(line) < 6:
-        print("parse error: input did not look like it was from iovisor/tools/biosnoop.py: line too short")
-        print(line)
-        sys.exit(1)
 
-    if line[4] == 'T' and line[5] == 'SECTOR' and line[6] == 'BYTES':
-        continue
+def load_record(path):
+    """ The sums over all slices of a --record file: (R counts, W counts, {'R<4k': latency histogram, ...}, seconds). """
+    r, w, lat = [0] * len(bucket_names), [0] * len(bucket_names), {}
+    t0 = t1 = None
+    for line in open(path):
+        rec = json.loads(line)
+        if 'R' not in rec:
+            if rec.get('buckets', bucket_names) != bucket_names:
+                print("ERROR: %s: recorded with other size buckets." % path)
+                sys.exit(1)
+            continue
+        t0 = rec['t'] if t0 is None else t0
+        t1 = rec['t'] + update_interval
+        for b in range(len(bucket_names)):
+            r[b] += rec['R'][b]
+            w[b] += rec['W'][b]
+        for key, h in rec['lat'].items():
+            t = lat.setdefault(key, [0] * lat_buckets)
+            for k, c in enumerate(h):
+                t[k] += c
+    return r, w, lat, (t1 - t0) if t0 is not None else 0.0
+
+
+def diff(before, after):
+    """ --diff: IOPS, p50 and p99 latency per size bucket of two --record files. """
+    a, b = load_record(before), load_record(after)
+    print("%-12s %21s %21s %21s" % ("", "IOPS", "p50 ms", "p99 ms"))
+    print("%-12s %10s %10s %10s %10s %10s %10s" % ("", "before", "after", "before", "after", "before", "after"))
+    for i, name in enumerate(bucket_names):
+        for rw, counts in (('R', 1), ('W', 2)):
+            if not a[counts-1][i] and not b[counts-1][i]:
+                continue
+            key = rw + name
+            row = []
+            for rec in a, b:
+                row.append("%.1f" % (rec[counts-1][i] / rec[3]) if rec[3] else '-')
+            for p in 0.5, 0.99:
+                for rec in a, b:
+                    row.append(fmt_ms(percentile(rec[2].get(key, [0]), p)))
+            print("%-12s %10s %10s %10s %10s %10s %10s" % (tuple(["%5s %s" % (name, rw)] + row)))
+
+
+class PacedReader:
+    """ --replay: reads a biosnoop capture like stdin, at speed times the pace of its TIME(s) column.
+        read1() returns all lines that are due, and only sleeps when none is.
+    """
+    def __init__(self, f, speed):
+        self.f = f
+        self.speed = speed
+        self.t0 = None
+        self.start = None
+        self.pending = b''
+
+    def read1(self, size):
+        out = []
+        n = 0
+        while n < size:
+            line = self.pending or self.f.readline()
+            self.pending = b''
+            if not line:
+                break
+            try:
+                t = float(line.split(None, 1)[0])
+            except (ValueError, IndexError):
+                out.append(line)            # the header
+                n += len(line)
+                continue
+            if self.t0 is None:
+                self.t0, self.start = t, time.monotonic()
+            wait = self.start + (t - self.t0) / self.speed - time.monotonic()
+            if wait > 0:
+                if out:
+                    self.pending = line
+                    break
+                time.sleep(wait)
+            out.append(line)
+            n += len(line)
+        return b''.join(out)
+
+
+# --ebpf: the request size and latency of each block I/O, as slots of log2 (bytes, microseconds),
+# like int.bit_length() gives them. Counted in the kernel, only the map is read from user space.
+bpf_text = """
+#include <uapi/linux/ptrace.h>
+
+struct req_key { u32 dev; u32 pad; u64 sector; };     // explicit padding, zeroed: it is part of the key.
+struct start_val { u64 ts; u64 bytes; u32 rw; };
+struct hist_key { u32 rw; u32 size_slot; u32 lat_slot; };
+
+BPF_HASH(start, struct req_key, struct start_val, 10240);
+BPF_HISTOGRAM(hist, struct hist_key, 4096);
+
+TRACEPOINT_PROBE(block, block_rq_issue)
+{
+    struct req_key k = {.dev = args->dev, .sector = args->sector};
+    struct start_val v = {.ts = bpf_ktime_get_ns(), .bytes = args->bytes};
+    // rwbs is like "R", "RA", "WS", "FWS": a W among the first chars is a write, like in biosnoop.
+    #pragma unroll
+    for (int i = 0; i < 4; i++) {
+        if (args->rwbs[i] == 'W') {
+            v.rw = 1;
+            break;
+        }
+        if (args->rwbs[i] == 0)
+            break;
+    }
+    if (v.bytes)                    // flushes carry no data
+        start.update(&k, &v);
+    return 0;
+}
+
+TRACEPOINT_PROBE(block, block_rq_complete)
+{
+    struct req_key k = {.dev = args->dev, .sector = args->sector};
+    struct start_val *v = start.lookup(&k);
+    if (v == 0)
+        return 0;
+    u64 us = (bpf_ktime_get_ns() - v->ts) / 1000;
+    struct hist_key h = {.rw = v->rw, .size_slot = bpf_log2l(v->bytes), .lat_slot = us ? bpf_log2l(us) : 0};
+    hist.increment(h);
+    start.delete(&k);
+    return 0;
+}
+"""
+
+
+class EbpfCollector:
+    """ --ebpf: reads the histogram map of the BPF program once per interval, and adds what it
+        counted since the last read into a window. The map is not cleared, so no event is lost
+        between reading and clearing. bpf is a bcc.BPF, or anything with a 'hist' map like it.
+    """
+    def __init__(self, bpf):
+        self.hist = bpf['hist']
+        self.prev = {}
+
+    def poll(self, window, now):
+        for k, v in self.hist.items():
+            key = (k.rw, k.size_slot, k.lat_slot)
+            n = v.value - self.prev.get(key, 0)
+            if n:
+                self.prev[key] = v.value
+                # bucket boundaries are powers of two, all sizes of a slot are in the same bucket.
+                window.add_many(now, 1 if k.rw else 0, bucket((1 << k.size_slot) >> 1), min(k.lat_slot, lat_buckets - 1), n)
+
+
+FakeKey = namedtuple('FakeKey', 'rw size_slot lat_slot')
+FakeValue = namedtuple('FakeValue', 'value')
+
+
+class FakeHist:
+    # like a BPF_HISTOGRAM map of bcc: items() gives keys with fields, and values with .value.
+    def __init__(self):
+        self.counts = {}
+
+    def items(self):
+        return [(k, FakeValue(v)) for k, v in list(self.counts.items())]
+
+
+class FakeBPF:
+    """ --fake_bpf CAPTURE: a stand-in for bcc.BPF(text=bpf_text), to run --ebpf without root or bcc.
+        A thread counts the events of a biosnoop capture into the 'hist' map, as the kernel program
+        would, at --speed times the pace of their TIME(s) column. It is the sink of parse().
+    """
+    def __init__(self, capture, speed):
+        self.maps = {'hist': FakeHist()}
+        inp = open(capture, 'rb')
+        self.thread = threading.Thread(target=parse, args=(PacedReader(inp, speed) if speed else inp, self), daemon=True)
+        self.thread.start()
+
+    def __getitem__(self, name):
+        return self.maps[name]
+
+    def add(self, now, rw, b, lb, nbytes=0, group=None):
+        counts = self.maps['hist'].counts
+        k = FakeKey(int(rw), nbytes.bit_length(), lb)
+        counts[k] = counts.get(k, 0) + 1
+
+
+def parse_error(msg, line):
+    print("parse error: input did not look like it was from iovisor/tools/biosnoop.py: " + msg)
+    print([f.decode(errors='replace') for f in line])
+    sys.exit(1)
+
+
+def find_columns(line):
+    """ Positions of the T, BYTES, LAT(ms), PID and DISK columns, counted from the end of the line, as
+        COMM may contain blanks. From the header, or guessed from the first line, if the header is missing.
+    """
+    if len(line) < 6:
+        parse_error("line too short", line)
+    if b'BYTES' in line:
+        for name in (b'T', b'LAT(ms)', b'PID', b'DISK'):
+            if name not in line:
+                parse_error("no %s column in the header" % name.decode(), line)
+        return tuple(len(line) - line.index(name) for name in (b'T', b'BYTES', b'LAT(ms)', b'PID', b'DISK'))
     for i in range(4, len(line)-2):
-        if line[i] in ('W','R') and line[i+1].isdigit() and line[i+2].isdigit():
-            break
-    else:
-        print("parse error: input did not look like it was from iovisor/tools/biosnoop.py: R/W column not found")
-        print(line)
+        if line[i] in (b'W', b'R') and line[i+1].isdigit() and line[i+2].isdigit():
+            return len(line) - i, len(line) - i - 2, 1, len(line) - i + 2, len(line) - i + 1
+    parse_error("R/W column not found", line)
+
+
+def group_key(by, cols):
+    # the function, that gives the group of a line for --by. COMM is all between TIME(s) and PID.
+    p, d = cols[3], cols[4]
+    if by == 'disk':
+        return lambda line: line[-d]
+    if by == 'comm':
+        return lambda line: b' '.join(line[1:-p])
+    return lambda line: b' '.join(line[1:-p]) + b'[' + line[-p] + b']'
+
+
+def parse(inp, window, on_update=None, by=None, block_size=1 << 20):
+    """ Feeds the biosnoop lines of the binary stream inp into window. Reads blocks of whatever is
+        available, up to block_size bytes. The TIME(s) column is the clock. on_update(now) is called
+        at most every update_interval seconds of that clock, between blocks. by is None, 'disk',
+        'comm' or 'pid', the group of each event.
+        Returns the number of lines.
+    """
+    ct = cb = cl = None
+    group = None
+    lat_last = lat_buckets - 1
+    rest = b''
+    nlines = 0
+    now = 0.0
+    printed = None
+    add = window.add
+    while True:
+        block = inp.read1(block_size)
+        if not block:
+            if not rest:
+                break
+            block = b'\n'
+        lines = (rest + block).split(b'\n')
+        rest = lines.pop()
+        nlines += len(lines)
+        for raw in lines:
+            line = raw.split()
+            try:
+                now = float(line[0])
+                n = int(line[-cb])
+                add(now, line[-ct] != b'R', bisect_right(bucket_sizes, n), min(int(float(line[-cl]) * 1000).bit_length(), lat_last),
+                    n, group(line) if group else None)
+            except (TypeError, IndexError, ValueError):
+                # the header, the first line without a header, or garbage.
+                if not line:
+                    nlines -= 1
+                    continue
+                header = b'BYTES' in line
+                if ct is not None and not header:
+                    parse_error("bad line", line)
+                cols = find_columns(line)
+                ct, cb, cl = cols[:3]
+                if by:
+                    group = group_key(by, cols)
+                if header:
+                    nlines -= 1
+                    continue
+                try:
+                    now = float(line[0])
+                except ValueError:
+                    parse_error("TIME(s) column not found", line)
+                n = int(line[-cb])
+                add(now, line[-ct] != b'R', bucket(n), lat_bucket(float(line[-cl])), n, group(line) if group else None)
+        if on_update and (printed is None or now >= printed + update_interval):
+            printed = now
+            window.advance(now)
+            on_update(now)
+    return nlines
+
+
+parser = argparse.ArgumentParser(description="Histogram of I/O sizes, from the output of iovisor/bcc biosnoop.py on stdin.",
+                                 epilog="Usage:\n\t sudo python -u biosnoop.py | " + sys.argv[0] + """
+
+Keep a capture, and a time series of the histograms, to compare after a change:
+\t sudo python -u biosnoop.py | tee before.txt | """ + sys.argv[0] + """ --record before.jsonl
+\t """ + sys.argv[0] + """ --replay before.txt --speed 10
+\t """ + sys.argv[0] + """ --bench after.txt --record after.jsonl
+\t """ + sys.argv[0] + """ --diff before.jsonl after.jsonl""", formatter_class=argparse.RawDescriptionHelpFormatter)
+parser.add_argument('--bench', metavar='CAPTURE', help='replay a recorded biosnoop output as fast as possible, without display. Prints lines/s.')
+parser.add_argument('--by', choices=('disk', 'comm', 'pid'), help='also aggregate by disk, by process name, or by process, and show the top ones by bytes and by p99 latency.')
+parser.add_argument('--top', metavar='N', type=int, default=5, help='length of the top lists of --by. Default: 5')
+parser.add_argument('--max_groups', metavar='N', type=int, default=1000, help='keep at most N groups of --by in the window, count the rest as "other". Default: 1000')
+parser.add_argument('--record', metavar='FILE', help='write the histograms of every update interval to FILE, as JSON lines.')
+parser.add_argument('--replay', metavar='CAPTURE', help='read a recorded biosnoop output instead of stdin, at the pace of its TIME(s) column.')
+parser.add_argument('--speed', metavar='X', type=float, default=1.0, help='--replay X times faster, 0 for as fast as possible. Default: 1')
+parser.add_argument('--diff', metavar='FILE', nargs=2, help='compare two --record files: IOPS, p50 and p99 latency per size bucket.')
+parser.add_argument('--ebpf', action='store_true', help='do not read stdin, trace block I/O with an own BPF program, that keeps the histograms in the kernel. Needs BCC and root.')
+parser.add_argument('--fake_bpf', metavar='CAPTURE', help='like --ebpf, but a stand-in feeds the maps from a biosnoop capture, paced with --speed. For testing.')
+args = parser.parse_args()
+ebpf = args.ebpf or args.fake_bpf
+if ebpf and (args.by or args.bench or args.replay):
+    print("ERROR: --ebpf does not mix with --by, --bench or --replay.")
+    sys.exit(1)
+
+if args.diff:
+    diff(*args.diff)
+    sys.exit(0)
+
+recorder = Recorder(args.record, args.by) if args.record else None
+
+if args.bench:
+    window = Window(time_window, update_interval, len(bucket_names), args.max_groups)
+    if recorder:
+        window.on_slice = recorder.slice
+    start = time.perf_counter()
+    with open(args.bench, 'rb') as inp:
+        nlines = parse(inp, window, by=args.by)
+    window.flush()
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    if recorder:
+        recorder.close()
+    print("lines:   %d" % nlines)
+    print("seconds: %.3f" % elapsed)
+    print("lines/s: %d" % (nlines / elapsed))
+    print("last window:")
+    for i in range(len(bucket_names)):
+        print("%5s R %7d  p50 %s p99 %s ms   W %7d  p50 %s p99 %s ms" % (bucket_names[i],
+              window.r[i], fmt_ms(percentile(window.hist(0, i), 0.5)), fmt_ms(percentile(window.hist(0, i), 0.99)),
+              window.w[i], fmt_ms(percentile(window.hist(1, i), 0.5)), fmt_ms(percentile(window.hist(1, i), 0.99))))
+    if args.by:
+        print("\n".join(top_lines(window, args.top)))
+    sys.exit(0)
+
+if args.fake_bpf:
+    bpf = FakeBPF(args.fake_bpf, args.speed)
+elif args.ebpf:
+    try:
+        from bcc import BPF
+    except ImportError:
+        print("ERROR: bcc not found. Try:\n\t apt install python3-bpfcc\n")
+        sys.exit(1)
+    try:
+        bpf = BPF(text=bpf_text)
+    except Exception as e:
+        print("ERROR: --ebpf: cannot load the BPF program (root needed?): %s" % e)
         sys.exit(1)
+elif args.replay:
+    inp = open(args.replay, 'rb')
+    if args.speed:
+        inp = PacedReader(inp, args.speed)
+elif sys.stdin.isatty():
+    parser.print_help()
+    sys.exit(0)
+else:
+    inp = sys.stdin.buffer
+
+window = Window(time_window, update_interval, len(bucket_names), args.max_groups)
+if recorder:
+    window.on_slice = recorder.slice
+printcount = 0
+tty = sys.stdout.isatty()
 
-    now = time.time()
-    queue.append([now, line[i], bucket(int(line[i+2]))])
-    while len(queue) and queue[0][0] < now - time_window:
-        queue.popleft()
-        # print('x')
 
-    if printed_tstamp + update_interval < now:
-        printed_tstamp = now
-        print_stats(queue)
-        printcount += 1
-        print("\\|/-"[printcount % 4] + "\r", end='', flush=True)
+def update(now):
+    global printcount
+    if not tty:
+        return          # redirected, e.g. with --record: no bars, no cursor movements.
+    print_stats(window)
+    printcount += 1
+    print("\\|/-"[printcount % 4] + "\r", end='', flush=True)
 
-    # time.sleep(0.1)
+
+try:
+    if ebpf:
+        collector = EbpfCollector(bpf)
+        start = time.monotonic()
+        k = 0
+        while True:
+            k += 1
+            time.sleep(max(0.0, start + k * update_interval - time.monotonic()))
+            finished = args.fake_bpf and not bpf.thread.is_alive()
+            collector.poll(window, (k - 0.5) * update_interval)      # the events of the slice, that ends now
+            window.advance(k * update_interval)
+            update(k * update_interval)
+            if finished:
+                break
+    else:
+        parse(inp, window, update, args.by)
+except KeyboardInterrupt:
+    pass
+window.flush()
+if recorder:
+    recorder.close()
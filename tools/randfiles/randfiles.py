@@ -25,7 +25,8 @@
 #  * https://docs.microsoft.com/en-us/windows/win32/fileio/naming-a-file#maximum-path-length-limitation
 #  * https://docs.python.org/3/using/windows.html
 #
-# TODO: On Linux, even deeper paths may be possible when using chdir() into each subdirectory.
+# On Linux, even deeper paths are possible with --engine dirfd: each directory is opened relative
+# to its parent, and files are created relative to that, so no path is ever longer than one name.
 
 # v0.1 -- 2019-09-03, jw        initial draught
 # v0.2 -- 2019-09-05, jw        adaptive min_entries_per_dir and folder_ratio for very tall trees.
@@ -34,12 +35,36 @@
 # v0.5 -- 2019-09-12, jw        new -t option to test max tree dimensions.
 # v0.6 -- 2019-11-20, jw        count folders against -m too, so that we can properly build structures with mostly folders.
 # v0.7 -- 2021-04-21, jw        added -s suffix option.
+# v0.8 -- 2026-10-18, jw        new -j option: populate directories with a pool of worker processes.
+#                               Uses per-directory seeding (stream 'perdir'), independent of the number of workers.
+# v0.9 -- 2026-10-18, jw        directory queue is a deque of (parent, name, depth) records, with -j bounded by the remaining budget.
+#                               peak_rss_kb reported in the result.
+# v0.10 -- 2026-10-18, jw       new --engine dirfd: create via openat()/mkdirat() on cached directory fds. -t probes it.
+# v0.11 -- 2026-10-18, jw       new --writer threads: batched creates on a pool of threads. files/s and MB/s reported.
+# v0.12 -- 2026-10-18, jw       file bodies are memoryview slices of a bytes corpus, written in binary mode. Same trees.
+# v0.13 -- 2026-10-18, jw       new -D size distributions, bodies larger than the corpus, --body sparse/fallocate.
+# v0.14 -- 2026-10-18, jw       periodic checkpoint in DIR/DIR.ckpt, new --resume option.
+# v0.15 -- 2026-10-18, jw       new --manifest option, new --verify mode with a parallel scandir walk.
+# v0.16 -- 2026-10-18, jw       new --tar and --zip options: stream the tree as an archive to a file, stdout or tcp://.
+# v0.17 -- 2026-10-18, jw       new --dav URL: MKCOL and PUT on keep-alive connections, latency percentiles reported.
+# v0.18 -- 2026-10-18, jw       latency histograms per operation, rng_s and syscall_s in the result. New --stats FILE: JSON lines.
+# v0.19 -- 2026-10-18, jw       new --rate and --rate_mb options: paced load with a token bucket, constant or ramped.
+# v0.20 -- 2026-10-18, jw       new --workload mode: a mix of stat, read, overwrite, rename, unlink, mkdir, create on a tree.
+# v0.21 -- 2026-10-18, jw       -t finds exact limits by bisection, probes in parallel, more probes, writes DIR/DIR.fsprofile.
+# v0.22 -- 2026-10-18, jw       new --delete mode: parallel removal relative to directory fds. -t cleans up the same way.
+# v0.23 -- 2026-10-18, jw       new stream 'numpy' (--stream numpy): per directory, all draws in NumPy batches. Needs numpy.
+# v0.24 -- 2026-10-18, jw       importable: setup() and tree_entries(), a lazy generator of the tree entries, no backend needed.
 
 
-import random, time, string, os, sys, json
-import argparse, shutil
+import random, time, string, os, sys, json, math, itertools
+import argparse, stat
+import multiprocessing, threading, queue, hashlib
+import tarfile, zipfile, socket, base64
+import http.client, urllib.parse
+import concurrent.futures
+from collections import deque, OrderedDict, namedtuple
 
-__version__ = '0.7'
+__version__ = '0.24'
 
 conf = {
   'maxfiles': 1_000_000,
@@ -52,270 +77,2519 @@ conf = {
   'max_body_len': 1_000,
   'folder_ratio': 0.5,                # 2.0/100=0.02: 98% of all objects, are files; 2% are folders.
   'corpus_size': 2_000_000,
+  'stream': 'legacy',                 # 'legacy': one random stream for the whole tree. 'perdir': each directory seeded from seed and path.
+                                      # 'numpy': like 'perdir', but drawn in batches with a NumPy PCG64 generator. Other trees.
+  'size_dist': 'uniform',             # body lengths: 'uniform', 'lognormal:MEDIAN:SIGMA', 'pareto:ALPHA' or 'hist' (with size_hist)
+  'body': 'data',                     # 'data': random bytes. 'sparse': holes only. 'fallocate': allocated, but unwritten.
 }
 
-conf_run = {
-  'argv0': os.path.abspath(sys.argv[0]),
-  '__version__': __version__,
-  'when': time.ctime(),
-}
+conf_defaults = dict(conf)
 
-parser = argparse.ArgumentParser(description='Create deep or shallow trees of random files.')
-parser.add_argument('dir', metavar='DIR', type=str, help='destination folder')
-parser.add_argument('-m', '--maxfiles', metavar='MAXFILES', type=int, help='Number of files and folders to generate. Default: ' + str(conf['maxfiles']))
-parser.add_argument('-S', '--seed', metavar='SEED_STRING', type=str, help='String to seed the random generator. Call with identical seed to recreate an identical tree. Default: current timestamp in msec')
-parser.add_argument('-f', '--folder_ratio', metavar='FOLDER_PERCENTAGE', type=float, help='Probability to create a subfolder instead of a file, as percent. Default: ' + str(conf['folder_ratio']))
-parser.add_argument('-e', '--max_entries_per_dir', metavar='MAX_ENTRIES_PER_DIR', type=int, help='Maximum number files/subdirs per directory. Default: ' + str(conf['max_entries_per_dir']))
-parser.add_argument(      '--min_entries_per_dir', metavar='MIN_ENTRIES_PER_DIR', type=int, help='Minimum number files/subdirs per directory. Default: ' + str(conf['min_entries_per_dir']))
-parser.add_argument('-n', '--max_name_len', metavar='MAX_NAME_LEN', type=int, help='Maximum length of file/subdir names. Default: ' + str(conf['max_name_len']))
-parser.add_argument(      '--min_name_len', metavar='MIN_NAME_LEN', type=int, help='Minimum length of file/subdir names. Default: ' + str(conf['min_name_len']))
-parser.add_argument('-b', '--max_body_len', metavar='MAX_BODY_LEN', type=int, help='Maximum length file contents. Default: ' + str(conf['max_body_len']))
-parser.add_argument(      '--min_body_len', metavar='MIN_BODY_LEN', type=int, help='Minimum length file contents. Default: ' + str(conf['min_body_len']))
-parser.add_argument('-c', '--corpus_size', metavar='CORPUS_SIZE', type=int, help='Size of the internal random pool. (Larger is more chaotic but slower). Default: ' + str(conf['corpus_size']))
-parser.add_argument('-L', '--load_config', metavar='CONFIG_FILE', type=str, help='Load a config file from a previous run, before applying other options. Default: none.')
-parser.add_argument('-t', '--testonly', action='store_true', help='Only test how deep or wide a tree could be. Default: create a tree.')
-parser.add_argument('-s', '--suffix', metavar='SUFFIX', type=str, help='Common suffix for all file names generated. Default: none')
-args = parser.parse_args()
-
-if args.load_config:
-  conf = json.load(open(args.load_config))
-conf['run'] = conf_run
-
-if args.maxfiles            is not None: conf['maxfiles']            = args.maxfiles
-if args.seed                is not None: conf['seed']                = args.seed
-if args.folder_ratio        is not None: conf['folder_ratio']        = args.folder_ratio
-if args.max_entries_per_dir is not None: conf['max_entries_per_dir'] = args.max_entries_per_dir
-if args.min_entries_per_dir is not None: conf['min_entries_per_dir'] = args.min_entries_per_dir
-if args.max_name_len        is not None: conf['max_name_len']        = args.max_name_len
-if args.min_name_len        is not None: conf['min_name_len']        = args.min_name_len
-if args.max_body_len        is not None: conf['max_body_len']        = args.max_body_len
-if args.min_body_len        is not None: conf['min_body_len']        = args.min_body_len
-if args.corpus_size         is not None: conf['corpus_size']         = args.corpus_size
-if args.suffix              is not None: conf['suffix']              = args.suffix
-
-if conf['max_entries_per_dir'] < 5000:
-  maxmin = int(conf['max_entries_per_dir'])
-  if conf['min_entries_per_dir'] > maxmin:
-    print("Reducing min_entries_per_dir from %d to %d due to low max_entries_per_dir." % (conf['min_entries_per_dir'], maxmin))
-    conf['min_entries_per_dir'] = maxmin
-
-if conf['max_entries_per_dir'] < 500:
-  if conf['folder_ratio'] < 1.0:
-    # try avoid running out of subdirs
-    print("Increasing folder_ratio from %g to %g due to low max_entries_per_dir." % (conf['folder_ratio'], 1.0))
-    conf['folder_ratio'] = 1.0
-  if conf['max_name_len'] > 50:
-    # try avoid crashing against MAXPATH trivially.
-    print("Reducing max_name_len from %d to %d due to low max_entries_per_dir." % (conf['max_name_len'], 50))
-    conf['max_name_len'] = 50
-
-if conf['min_name_len'] > conf['max_name_len']:
-  print("Reducing min_name_len from %d to %d due to low max_name_len." % ( conf['min_name_len'], max(1, int(conf['max_name_len']/10)) ))
-  conf['min_name_len'] = max(1, int(conf['max_name_len']/10))
-
-if conf['corpus_size'] < conf['max_name_len']:
-  print("ERROR: corpus_size=%d must be at least max_name_len=%d." % (conf['corpus_size'], conf['max_name_len']))
-  sys.exit(1)
-
-if conf['corpus_size'] < conf['max_body_len']:
-  print("ERROR: corpus_size=%d be at least max_body_len=%d." % (conf['corpus_size'], conf['max_body_len']))
-  sys.exit(1)
-
-conffile = os.path.basename(os.path.abspath(args.dir))+'.conf'
-
-os.makedirs(args.dir, exist_ok=True)
-os.chdir(args.dir)      # or explode.
-
-if args.testonly:
-  incr = 10
-  testdepth = 10_000
-  testwidth = 20_000
-  testnamelen = 10_000
-  testfolder = "_t"
-  if sys.platform == 'win32':
-    testdepth = 1_000           # Windows 10 on NTFS with LongPathsEnabled=1, 10_000 takes ages.
-    testwidth = 2_000           # Windows 10 on NTFS is just dead slow.
-
-  def myrmtree(path):
-    sys.setrecursionlimit(testdepth+2)
-
-    try:        # linux only: avoid soft limits.
-      import resource
-      a = resource.getrlimit(resource.RLIMIT_NOFILE)
-      resource.setrlimit(resource.RLIMIT_NOFILE, (a[1], a[1]))
-    except:
+# The tree model, set up by setup() or by the script below.
+size_dist = None
+corpus = None
+corpus_bytes = None
+legacy_state = None       # of the generator of stream 'legacy', after the corpus is made.
+
+
+def make_corpus(rng):
+  # the corpus of names and bodies, the first draws of the tree.
+  return ''.join(rng.choice(string.ascii_letters + string.digits) for _ in range(conf['corpus_size']))
+
+
+def parse_size_dist(c):
+  """ The size distribution of config c, as randsize() uses it. Raises ValueError when it is not understood. """
+  size_dist = c['size_dist'].split(':')
+  try:
+    if size_dist[0] == 'uniform':
       pass
+    elif size_dist[0] == 'lognormal':
+      median, sigma = float(size_dist[1]), float(size_dist[2])
+      if not (0 < median < math.inf and 0 <= sigma < math.inf):
+        raise ValueError('MEDIAN must be > 0, SIGMA >= 0')
+      size_dist = [size_dist[0], math.log(median), sigma]
+    elif size_dist[0] == 'pareto':
+      alpha = float(size_dist[1])
+      if not 0 < alpha < math.inf:
+        raise ValueError('ALPHA must be > 0')
+      size_dist = [size_dist[0], alpha]
+    elif size_dist[0] == 'hist':
+      hist = c['size_hist']
+      if not hist or sum(h[1] for h in hist) <= 0:
+        raise ValueError('the histogram has no weight')
+      if hist[0][0] < 0 or min(h[1] for h in hist) < 0:
+        raise ValueError('negative UPPER_LEN or WEIGHT')
+      for a, b in zip(hist, hist[1:]):
+        if a[0] >= b[0]:
+          raise ValueError('UPPER_LEN %d repeated' % b[0])
+      size_dist = [size_dist[0], [h[0] for h in hist], list(itertools.accumulate(h[1] for h in hist))]
+    else:
+      raise ValueError('unknown distribution ' + size_dist[0])
+  except (IndexError, KeyError) as e:
+    raise ValueError(e)
+  return size_dist
 
-    try:
-      shutil.rmtree(path)
-    except OSError as e:
-      print("myrmtree: had an OSError. errno=%d strerror=%s" % (e.errno, e.strerror))
-      if e.errno == 24:         # Too many open files
-        print("Try switching to superuser, run\n  ulimit -n %d\n\n... or higher, then retry." % (testdepth+2))
-        sys.exit(1)
-      else:
-        raise(e)
 
-  os.makedirs(testfolder, exist_ok=False)       # explode early, if another test is running here.
-  for l in range(incr, testnamelen, incr):
-    path = testfolder +"/" + "f" * l   # one file with long name
+def read_size_hist(path):
+  """ The [UPPER_LEN, WEIGHT] lines of a hist:FILE, sorted. Raises ValueError when it cannot be read or parsed. """
+  try:
+    lines = open(path).readlines()
+  except OSError as e:
+    raise ValueError('%s: %s' % (path, e.strerror))
+  hist = []
+  for n, line in enumerate(lines, 1):
+    line = line.split('#')[0].split()
+    if not line:
+      continue
     try:
-      fd = open(path, "w")
-    except:
-      print("open() with a long file name:          limit exceeded at namelen=%d (...+%d), pathlen=%d\n" % (l-incr+1, incr-1, len(path)))
-      break
+      if len(line) != 2:
+        raise ValueError
+      hist.append([int(line[0]), float(line[1])])
+    except ValueError:
+      raise ValueError('%s line %d: expected "UPPER_LEN WEIGHT"' % (path, n))
+  return sorted(hist)
+
+
+def normalize_conf(c, say=None):
+  """ Adjusts config c for low max_entries_per_dir and max_name_len, like the script does before a run.
+      say(message) is called for each change. Raises ValueError when c cannot make a tree.
+  """
+  say = say or (lambda message: None)
+  if c['max_entries_per_dir'] < 5000:
+    maxmin = int(c['max_entries_per_dir'])
+    if c['min_entries_per_dir'] > maxmin:
+      say("Reducing min_entries_per_dir from %d to %d due to low max_entries_per_dir." % (c['min_entries_per_dir'], maxmin))
+      c['min_entries_per_dir'] = maxmin
+
+  if c['max_entries_per_dir'] < 500:
+    if c['folder_ratio'] < 1.0:
+      # try avoid running out of subdirs
+      say("Increasing folder_ratio from %g to %g due to low max_entries_per_dir." % (c['folder_ratio'], 1.0))
+      c['folder_ratio'] = 1.0
+    if c['max_name_len'] > 50:
+      # try avoid crashing against MAXPATH trivially.
+      say("Reducing max_name_len from %d to %d due to low max_entries_per_dir." % (c['max_name_len'], 50))
+      c['max_name_len'] = 50
+
+  if c['min_name_len'] > c['max_name_len']:
+    say("Reducing min_name_len from %d to %d due to low max_name_len." % (c['min_name_len'], max(1, int(c['max_name_len']/10))))
+    c['min_name_len'] = max(1, int(c['max_name_len']/10))
+
+  if c['corpus_size'] < c['max_name_len']:
+    raise ValueError("corpus_size=%d must be at least max_name_len=%d" % (c['corpus_size'], c['max_name_len']))
+
+
+def setup(c=None):
+  """ For use as a module: sets up the tree model for config c, like a .conf file. Missing keys have
+      the defaults of the script, and are adjusted like the script does. Raises ValueError for a config
+      that cannot make a tree. Returns the generator of stream 'legacy', to pass to tree_entries().
+      tree_entries() without it starts a generator of its own in the same state.
+
+      import randfiles
+      randfiles.setup({'seed': 'foo', 'maxfiles': 10**9, 'stream': 'perdir'})
+      for e in randfiles.tree_entries():
+        ...
+  """
+  global conf, size_dist, corpus, corpus_bytes, numpy, legacy_state
+  conf = dict(conf_defaults, **(c or {}))
+  normalize_conf(conf)
+  size_dist = parse_size_dist(conf)
+  if conf['stream'] == 'numpy':
+    import numpy
+  rng = random.Random(conf['seed'])
+  corpus = make_corpus(rng)
+  corpus_bytes = memoryview(corpus.encode())
+  legacy_state = rng.getstate()
+  return rng
+
+
+def randstr(min_len=10, max_len=200, rng=random):
+  len = rng.randint(min_len, max_len)
+  len = min(len, conf['corpus_size'])
+  start = rng.randint(0, conf['corpus_size']-len)
+  return corpus[start:start+len]
+
+
+def randsize(min_len, max_len, rng=random):
+  if size_dist[0] == 'uniform':
+    return rng.randint(min_len, max_len)
+  if size_dist[0] == 'lognormal':
+    n = rng.lognormvariate(size_dist[1], size_dist[2])
+  elif size_dist[0] == 'pareto':
+    n = max(1, min_len) * rng.paretovariate(size_dist[1])
+  else:
+    # pick a bucket by weight, then uniform up to its upper length.
+    i = rng.choices(range(len(size_dist[1])), cum_weights=size_dist[2])[0]
+    n = rng.randint(size_dist[1][i-1] + 1 if i else 0, size_dist[1][i])
+  return max(min_len, min(max_len, int(n)))
+
+
+class LongBody:
+  """ A body larger than the corpus. Written in chunks, wrapping around at the end of the corpus. """
+  chunk_size = 1024*1024
+
+  def __init__(self, start, length):
+    self.start = start
+    self.length = length
+
+  def __len__(self):
+    return self.length
+
+  def chunks(self):
+    pos, todo = self.start, self.length
+    while todo:
+      n = min(todo, self.chunk_size, conf['corpus_size'] - pos)
+      yield corpus_bytes[pos:pos+n]
+      todo -= n
+      pos = (pos + n) % conf['corpus_size']
+
+  def write(self, fd):
+    for chunk in self.chunks():
+      write_all(fd, chunk)
+
+
+class HoleBody:
+  """ --body sparse or fallocate: only the length, no data is written. """
+  def __init__(self, length):
+    self.length = length
+
+  def __len__(self):
+    return self.length
+
+  def write(self, fd):
+    if conf['body'] == 'fallocate':
+      if self.length:
+        os.posix_fallocate(fd, 0, self.length)
     else:
-      fd.close()
-      os.unlink(path)
+      os.ftruncate(fd, self.length)
+
+
+def randbody(min_len=10, max_len=200, rng=random):
+  # same draws as randstr(), but a memoryview into corpus_bytes.
+  # The draws do not depend on --body, so a sparse tree has the same names and lengths.
+  len = randsize(min_len, max_len, rng)
+  if len <= conf['corpus_size']:
+    start = rng.randint(0, conf['corpus_size']-len)
+    body = corpus_bytes[start:start+len]
   else:
-    print("open() with a long file name:            (testnamelen=%d done; pathlen=%d)" % (testnamelen, len(path)))
-  myrmtree(testfolder)
+    start = rng.randint(0, conf['corpus_size']-1)
+    body = LongBody(start, len)
+  if conf['body'] != 'data':
+    return HoleBody(len)
+  return body
 
-  for l in range(incr, testnamelen, incr):
-    path = testfolder + "/" + "f" * l   # one folder with long name
-    try:
-      os.makedirs(path)
-    except:
-      print("makedirs() with one long folder name:  limit exceeded at namelen=%d (...+%d), pathlen=%d" % (l-incr+1, incr-1, len(path)))
-      break
+
+def randfile(rng=random):
+  name = randstr(conf['min_name_len'], conf['max_name_len'], rng)
+  body = randbody(conf['min_body_len'], conf['max_body_len'], rng)
+  if 'suffix' in conf: name = name + conf['suffix']
+  return (name, body)
+
+
+def randfolder(rng=random):
+  name = randstr(conf['min_name_len'], conf['max_name_len'], rng)
+  return name
+
+
+def dir_random(path, what=''):
+  # stream 'perdir': every directory has its own generator, derived from the seed and its path.
+  # Seeding with a str hashes it with sha512, independent of PYTHONHASHSEED.
+  return random.Random(conf['seed'] + '\0' + path + what)
+
+
+def dir_generator(path):
+  # stream 'numpy': like dir_random(), a PCG64 generator per directory, from the sha512 of the seed and its path.
+  return numpy.random.Generator(numpy.random.PCG64(int.from_bytes(hashlib.sha512((conf['seed'] + '\0' + path).encode()).digest(), 'big')))
+
+
+def dir_count(path):
+  # the number of entries of a directory with streams 'perdir' and 'numpy', the first draw of its generator.
+  if conf['stream'] == 'numpy':
+    return int(dir_generator(path).integers(conf['min_entries_per_dir'], conf['max_entries_per_dir'], endpoint=True))
+  return dir_random(path).randint(conf['min_entries_per_dir'], conf['max_entries_per_dir'])
+
+
+def numpy_sizes(g, n, min_len, max_len):
+  # randsize() for n bodies at once. NumPy's pareto is Pareto II, Python's paretovariate() is that plus one.
+  if size_dist[0] == 'uniform':
+    return g.integers(min_len, max_len, n, endpoint=True)
+  if size_dist[0] == 'lognormal':
+    sizes = g.lognormal(size_dist[1], size_dist[2], n)
+  elif size_dist[0] == 'pareto':
+    sizes = max(1, min_len) * (g.pareto(size_dist[1], n) + 1)
+  else:
+    upper = numpy.array(size_dist[1])
+    lower = numpy.concatenate(([0], upper[:-1] + 1))
+    i = numpy.searchsorted(size_dist[2], g.random(n) * size_dist[2][-1], side='right')
+    sizes = g.integers(lower[i], upper[i], endpoint=True)
+  return numpy.clip(sizes, min_len, max_len).astype(numpy.int64)
+
+
+def numpy_entries(path, count):
+  """ Stream 'numpy': the first count entries of directory path, each a (name, body) like randfile(),
+      or a name like randfolder(). All draws are done in a few calls for the whole directory.
+  """
+  g = dir_generator(path)
+  g.integers(conf['min_entries_per_dir'], conf['max_entries_per_dir'], endpoint=True)      # the entry count, used by the scheduler.
+  cs = conf['corpus_size']
+  is_file = g.random(count) > conf['folder_ratio'] * 0.01     # percent
+  name_len = numpy.minimum(g.integers(conf['min_name_len'], conf['max_name_len'], count, endpoint=True), cs)
+  name_start = g.integers(0, cs - name_len, endpoint=True)
+  body_len = numpy_sizes(g, count, conf['min_body_len'], conf['max_body_len'])
+  body_start = g.integers(0, numpy.where(body_len > cs, cs - 1, cs - body_len), endpoint=True)
+  suffix = conf.get('suffix', '')
+  entries = []
+  for f, ns, nl, bs, bl in zip(is_file.tolist(), name_start.tolist(), name_len.tolist(), body_start.tolist(), body_len.tolist()):
+    if not f:
+      entries.append(corpus[ns:ns+nl])
+    elif conf['body'] != 'data':
+      entries.append((corpus[ns:ns+nl] + suffix, HoleBody(bl)))
+    elif bl <= cs:
+      entries.append((corpus[ns:ns+nl] + suffix, corpus_bytes[bs:bs+bl]))
     else:
-      os.rmdir(path)
+      entries.append((corpus[ns:ns+nl] + suffix, LongBody(bs, bl)))
+  return entries
+
+
+def dir_path(d):
+  # Directories are queued as compact records (parent, name, depth). The parent is
+  # a reference, not a copy of the path, so finished subtrees are freed automatically.
+  names = []
+  while d:
+    names.append(d[1])
+    d = d[0]
+  return '/'.join(reversed(names))
+
+
+def frontier_full(queued, remaining):
+  # Streams 'perdir' and 'numpy': a queued directory is only visited, if the directories before it leave some
+  # of the budget. Each of them reserves at least min_entries_per_dir entries. Directories beyond (twice) that
+  # are still created, but never populated, so we need not remember them.
+  return queued >= 2 * -(-remaining // max(1, conf['min_entries_per_dir']))
+
+
+def write_all(fd, data):
+  while len(data):
+    data = data[os.write(fd, data):]
+
+
+def body_chunks(body):
+  # body as a sequence of bytes-like chunks, for writers that do not have a file descriptor.
+  if isinstance(body, (memoryview, bytes)):
+    yield body
+  elif isinstance(body, LongBody):
+    yield from body.chunks()
   else:
-    print(  "makedirs() with one long folder name:  (testnamelen=%d done; pathlen=%d)" % (testnamelen, len(path)))
-  myrmtree(testfolder)
+    # sparse and fallocate bodies are zeros there.
+    todo = len(body)
+    while todo:
+      n = min(todo, len(zeros))
+      yield zeros[:n]
+      todo -= n
 
-  for d in range(testdepth):
-    fname = "123456789_123456789_123456789_123456789_123456789"
-    path = testfolder + ("/" + fname) * d
+
+zeros = memoryview(bytes(1024*1024))
+
+
+def dir_entries(path, count):
+  # streams 'perdir' and 'numpy': the first count entries of directory path, each a (name, body) or a name.
+  if conf['stream'] == 'numpy':
+    return numpy_entries(path, count)
+  rng = dir_random(path)
+  rng.randint(conf['min_entries_per_dir'], conf['max_entries_per_dir'])       # the entry count, used by the scheduler.
+  return (randfile(rng) if rng.random() > conf['folder_ratio'] * 0.01 else randfolder(rng) for i in range(count))   # percent
+
+
+def plan_name(names, name, kind):
+  # Like on disk: a name can only be a folder once, and a file cannot replace a folder. A file can replace a file.
+  # names maps the names of one directory to their kind, 'f' or 'd'.
+  if names.get(name) == 'd' or (kind == 'd' and name in names):
+    return False
+  names[name] = kind
+  return True
+
+
+class Schedule:
+  """ The order in which the tree is made, shared by the script and tree_entries(), so that both make the same tree.
+      Directories are queued in dirs as records (parent, name, depth), breadth first. The consumer of the events
+      makes the entries and reports back which it could create, the schedule queues their folders.
+      planned counts the entries, that have their place: the created ones with stream 'legacy', the budgets
+      of the populated directories with 'perdir' and 'numpy'. pending are the (record, count) being populated,
+      done is set when the budget is used up. That is the state a checkpoint saves.
+  """
+  def __init__(self, dirs=None, pending=(), planned=0, done=0, ahead=2):
+    self.dirs = dirs if dirs is not None else deque([(None, '.', 1)])
+    self.pending = deque(pending)
+    self.planned = planned
+    self.done = done
+    self.ahead = ahead        # directories populated ahead, the script has two per -j worker.
+    self.rng_s = 0.0
+
+  def legacy(self, rng):
+    """ Stream 'legacy': one generator rng for the whole tree, one entry after the other. Yields events
+        (record, kind, entry): 'begin' and 'end' around each directory, 'f' with (name, body), 'd' with a name,
+        'e' with the name of an emergency folder. The consumer calls created() for each entry it could create.
+    """
+    maxfiles = conf['maxfiles']
+    while not self.done:
+      dirr = self.dirs.popleft()
+      yield dirr, 'begin', None
+      for i in range(rng.randint(conf['min_entries_per_dir'], conf['max_entries_per_dir'])):
+        if self.planned >= maxfiles:
+          self.done = 1
+          break
+        t = time.perf_counter()
+        if rng.random() > conf['folder_ratio'] * 0.01:   # percent
+          kind, f = 'f', randfile(rng)
+        else:
+          kind, f = 'd', randfolder(rng)
+        self.rng_s += time.perf_counter() - t
+        yield dirr, kind, f
+      while not self.dirs:
+        # all entries all folders were files. That is rare, but must not kill us.
+        # let us have one emergency folder, also when done.
+        yield dirr, 'e', randfolder(rng)
+      yield dirr, 'end', None
+
+  def perdir(self):
+    """ Streams 'perdir' and 'numpy': each directory has its own generator, and is populated as a whole.
+        Yields events (record, kind, value): 'populate' with the count of entries, the consumer starts to populate
+        the directory, maybe in the background, up to ahead at a time. 'populated' in the same order, the consumer
+        waits for it and calls populated(). Then 'e' with the name of an emergency folder, and 'end'.
+    """
+    maxfiles = conf['maxfiles']
+    for dirr, count in list(self.pending):
+      yield dirr, 'populate', count       # from a checkpoint: had their budget, but were not finished.
+    while self.pending or (self.dirs and not self.done):
+      if self.dirs and not self.done and len(self.pending) < self.ahead:
+        dirr = self.dirs.popleft()
+        count = min(dir_count(dir_path(dirr)), maxfiles - self.planned)
+        self.planned += count
+        if self.planned >= maxfiles:
+          self.done = 1
+        self.pending.append((dirr, count))
+        yield dirr, 'populate', count
+        continue
+      dirr, count = self.pending.popleft()
+      yield dirr, 'populated', count
+      emerg = 0
+      while not self.done and not self.dirs and not self.pending:
+        # all entries were files. Deterministic emergency folders.
+        yield dirr, 'e', randfolder(dir_random(dir_path(dirr), '\0emerg%d' % emerg))
+        emerg += 1
+      yield dirr, 'end', None
+
+  def created(self, dirr, kind, f):
+    # the consumer created entry f of kind 'f', 'd' or 'e' in directory dirr.
+    # No frontier_full() cut here: stream 'legacy' only counts what it could create, a directory can
+    # take less than min_entries_per_dir, and the folders cut off would have been populated.
+    self.planned += 1
+    if kind != 'f':
+      self.dirs.append((dirr, f, dirr[2]+1))
+
+  def populated(self, dirr, subdirs):
+    # streams 'perdir' and 'numpy': the consumer populated directory dirr, subdirs are the folders it created.
+    for s in subdirs:
+      if frontier_full(len(self.dirs), conf['maxfiles'] - self.planned):
+        break
+      self.dirs.append((dirr, s, dirr[2]+1))
+
+
+Entry = namedtuple('Entry', 'path kind size body')
+
+
+def tree_entries(rng=None):
+  """ The tree of conf, without writing it: a generator of Entry(path, kind, size, body) in creation order.
+      kind is 'd' or 'f', path is relative to the tree top. body is None for a folder, else something
+      body_chunks() takes. rng is the generator of stream 'legacy', as setup() returns it. Without,
+      a private one is seeded with conf['seed'], like the script seeds random, so each call makes the same tree.
+      This is the tree randfiles.py writes when no create fails, with any -j: a name that collides on
+      disk is skipped here too, a repeated file name comes twice, the last one wins.
+      Memory is bounded like the directory queue of the script, not by the size of the tree.
+  """
+  sched = Schedule()
+  if conf['stream'] == 'legacy':
+    if rng is None:
+      rng = random.Random()
+      rng.setstate(legacy_state)
+    for dirr, kind, f in sched.legacy(rng):
+      if kind == 'begin':
+        dir = dir_path(dirr)
+        names = {}
+      elif kind == 'f':
+        if plan_name(names, f[0], 'f'):
+          sched.created(dirr, kind, f)
+          yield Entry((dir + '/' + f[0])[2:], 'f', len(f[1]), f[1])
+      elif kind != 'end' and plan_name(names, f, 'd'):
+        sched.created(dirr, kind, f)
+        yield Entry((dir + '/' + f)[2:], 'd', 0, None)
+    return
+
+  # streams 'perdir' and 'numpy': in the order of the script with -j 1.
+  ahead = deque()         # (path, names, subdirs) of the directories populated ahead.
+  for dirr, kind, v in sched.perdir():
+    if kind == 'populate':
+      dir = dir_path(dirr)
+      names = {}
+      subdirs = []
+      for f in dir_entries(dir, v):
+        if type(f) is tuple:
+          if plan_name(names, f[0], 'f'):
+            yield Entry((dir + '/' + f[0])[2:], 'f', len(f[1]), f[1])
+        elif plan_name(names, f, 'd'):
+          subdirs.append(f)
+          yield Entry((dir + '/' + f)[2:], 'd', 0, None)
+      ahead.append((dir, names, subdirs))
+    elif kind == 'populated':
+      dir, names, subdirs = ahead.popleft()
+      sched.populated(dirr, subdirs)
+    elif kind == 'e' and plan_name(names, v, 'd'):
+      sched.created(dirr, kind, v)
+      yield Entry((dir + '/' + v)[2:], 'd', 0, None)
+
+
+# The script. Its functions use the options in args and the run state, which the driver
+# under __main__ sets up. Histogram, Manifest and the writers work without them.
+
+def parse_schedule(opt, spec):
+  # '1000' or '0:100,60:1000' -> [(0.0, 100.0), (60.0, 1000.0)]
+  if spec is None:
+    return None
+  try:
+    points = [tuple(float(v) for v in p.split(':')) if ':' in p else (0.0, float(p)) for p in spec.split(',')]
+    if any(len(p) != 2 or p[1] < 0 for p in points) or sorted(points) != points:
+      raise ValueError
+  except ValueError:
+    print("ERROR: %s %s: expected RATE or SECONDS:RATE,SECONDS:RATE,... with ascending SECONDS." % (opt, spec))
+    sys.exit(1)
+  return points
+
+
+workload_ops = ('stat', 'read', 'overwrite', 'rename', 'unlink', 'mkdir', 'create')
+
+
+O_DIR = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+O_CREATE = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_CLOEXEC', 0) | getattr(os, 'O_BINARY', 0)
+O_OVERWRITE = O_CREATE & ~os.O_CREAT        # --workload: only files that are still there.
+O_NEW = O_CREATE | os.O_EXCL                # --workload: only names that are not taken.
+
+
+try:
+  import xxhash
+  manifest_hash = 'xxh3-64'
+except ImportError:
+  manifest_hash = 'blake2b-128'
+
+
+def new_hash(algo=None):
+  if (algo or manifest_hash) == 'xxh3-64':
+    return xxhash.xxh3_64()
+  return hashlib.blake2b(digest_size=16)
+
+
+class Manifest:
+  """ Lines of 'KIND SIZE HASH PATH', tab separated, in creation order. KIND is f or d.
+      Directories and sparse files have '-' as hash. Paths are relative to the tree.
+  """
+  def __init__(self, path, offset=None):
+    if offset is None:
+      self.o = open(path, 'w')
+      self.o.write("# randfiles %s manifest hash=%s\n" % (__version__, manifest_hash))
+    else:
+      self.o = open(path, 'r+')
+      self.o.truncate(offset)   # drop what is written again after --resume.
+      self.o.seek(offset)
+
+  def tell(self):
+    self.o.flush()
+    return self.o.tell()
+
+  def add(self, lines):
+    self.o.writelines(lines)
+
+  def close(self):
+    self.o.close()
+
+
+def manifest_file(path, body):
+  # path starts with './'
+  if isinstance(body, HoleBody):
+    return "f\t%d\t-\t%s\n" % (len(body), path[2:])
+  h = new_hash()
+  for chunk in body.chunks() if isinstance(body, LongBody) else (body,):
+    h.update(chunk)
+  return "f\t%d\t%s\t%s\n" % (len(body), h.hexdigest(), path[2:])
+
+
+def manifest_dir(path):
+  return "d\t-\t-\t%s\n" % path[2:]
+
+
+def manifest_created(lines, w):
+  """ An async writer fails a create after file() returned. After w.drain(), its failed names
+      in the current directory are in w.failed, and their lines are dropped.
+  """
+  if not w.failed:
+    return lines
+  failed = set(w.failed)
+  del w.failed[:]
+  return [l for l in lines if l[0] != 'f' or l.rstrip('\n').split('\t', 3)[3].rsplit('/', 1)[-1] not in failed]
+
+
+def load_manifest(path):
+  expected = {}
+  algo = 'blake2b-128'
+  for line in open(path):
+    if line.startswith('#'):
+      if 'hash=' in line:
+        algo = line.split('hash=')[1].split()[0]
+      continue
+    kind, size, hash, name = line.rstrip('\n').split('\t', 3)
+    expected[name] = (kind, size, hash)
+  return expected, algo
+
+
+def open_rel(rootfd, rel):
+  # by path while that is short, one name at a time beyond.
+  if len(rel) < 2048:
+    return os.open(rel or '.', O_DIR, dir_fd=rootfd)
+  cut = rel.rfind('/', 0, 2048)
+  fd = os.open(rel[:cut], O_DIR, dir_fd=rootfd)
+  for name in rel[cut+1:].split('/'):
+    sub = os.open(name, O_DIR, dir_fd=fd)
+    os.close(fd)
+    fd = sub
+  return fd
+
+
+def verify_scan(rootfd, rel, expected, algo):
+  """ One directory of the --verify walk. Files are only read, if their size is right. """
+  fd = open_rel(rootfd, rel)
+  found = []
+  subdirs = []
+  nbytes = 0
+  try:
+    for e in os.scandir(fd):
+      path = rel + '/' + e.name if rel else e.name
+      if e.is_dir(follow_symlinks=False):
+        subdirs.append(path)
+        found.append((path, ('d', '-', '-')))
+        continue
+      if not rel and e.name.endswith(('.conf', '.ckpt', '.ckpt.tmp', '.manifest', '.fsprofile')):
+        continue        # ours, not part of the tree.
+      size = str(e.stat(follow_symlinks=False).st_size)
+      exp = expected.get(path)
+      hash = '-'
+      if exp and exp[0] == 'f' and exp[1] == size and exp[2] != '-':
+        h = new_hash(algo)
+        f = os.open(e.name, os.O_RDONLY, dir_fd=fd)
+        try:
+          while True:
+            chunk = os.read(f, 1024*1024)
+            if not chunk:
+              break
+            h.update(chunk)
+            nbytes += len(chunk)
+        finally:
+          os.close(f)
+        hash = h.hexdigest()
+      found.append((path, ('f', size, hash)))
+  finally:
+    os.close(fd)
+  return found, subdirs, nbytes
+
+
+def verify(expected, algo, threads=16):
+  """ Walk the tree in the current directory with a pool of threads, and compare with expected,
+      a dict path: (kind, size, hash). Prints the differences, returns their number.
+  """
+  start = time.time()
+  rootfd = os.open('.', O_DIR)
+  pool = concurrent.futures.ThreadPoolExecutor(max(1, threads))
+  inflight = set([pool.submit(verify_scan, rootfd, '', expected, algo)])
+  seen = ok = nbytes = 0
+  problems = []
+  while inflight:
+    done, inflight = concurrent.futures.wait(inflight, return_when=concurrent.futures.FIRST_COMPLETED)
+    for fut in done:
+      found, subdirs, b = fut.result()
+      nbytes += b
+      for sub in subdirs:
+        inflight.add(pool.submit(verify_scan, rootfd, sub, expected, algo))
+      for path, have in found:
+        seen += 1
+        exp = expected.pop(path, None)
+        if exp is None:
+          problems.append(('extra', path))
+        elif exp[0] != have[0]:
+          problems.append(('kind', path))
+        elif exp[1] != have[1]:
+          problems.append(('size', path))
+        elif exp[2] != '-' and exp[2] != have[2]:
+          problems.append(('hash', path))
+        else:
+          ok += 1
+  pool.shutdown()
+  os.close(rootfd)
+  problems.extend(('missing', path) for path in expected)
+  elapsed = max(time.time() - start, 1e-9)
+
+  for what, path in problems[:20]:
+    print("%-8s %s" % (what, path))
+  if len(problems) > 20:
+    print("... %d more." % (len(problems) - 20))
+  print("verified:    ", seen)
+  print("ok:          ", ok)
+  for what in ('missing', 'extra', 'kind', 'size', 'hash'):
+    print("%-13s" % (what + ':'), sum(1 for p in problems if p[0] == what))
+  print("entries/s:   ", int(seen / elapsed))
+  print("MB/s:        ", round(nbytes / elapsed / 1e6, 2))
+  return len(problems)
+
+
+def delete_scan(rootfd, rel):
+  """ One directory of the --delete walk: unlinks its files, returns its subdirectories, the number
+      of files and errors, and the unlink latencies.
+  """
+  hist = Histogram()
+  subdirs = []
+  files = errors = 0
+  fd = open_rel(rootfd, rel)
+  try:
+    for e in os.scandir(fd):
+      if e.is_dir(follow_symlinks=False):
+        subdirs.append(rel + '/' + e.name if rel else e.name)
+        continue
+      t = time.perf_counter()
+      try:
+        os.unlink(e.name, dir_fd=fd)
+        files += 1
+      except OSError:
+        errors += 1
+      hist.add(time.perf_counter() - t)
+  finally:
+    os.close(fd)
+  return subdirs, files, errors, hist
+
+
+def delete_files(rootfd, paths):
+  # files of a manifest. Already gone is fine.
+  hist = Histogram()
+  files = 0
+  for path in paths:
+    t = time.perf_counter()
     try:
-      os.makedirs(path)
-    except:
-      print("makedirs() with long folder names:     limit exceeded at depth=%d, pathlen=%d (...+%d)" % (d-1, len(path)-len(fname), len(fname)))
-      break
-  else:
-    print(  "makedirs() with long folder names:     (testdepth=%d done; pathlen=%d)" % (testdepth, len(path)))
-  myrmtree(testfolder)
+      os.unlink(path, dir_fd=rootfd)
+      files += 1
+    except OSError:
+      pass
+    hist.add(time.perf_counter() - t)
+  return [], files, 0, hist
+
 
-  for d in range(incr, testdepth, incr):
-    path = testfolder + "/f" * d
+def made_by_randfiles(dir, manifest_path=None):
+  """ For --delete: what tells that randfiles.py made dir. Its DIR.conf or DIR.ckpt, or a randfiles manifest
+      whose first entry is in dir. None, if nothing does.
+  """
+  base = os.path.basename(os.path.abspath(dir))
+  for name in (base + '.conf', base + '.ckpt'):
+    if os.path.isfile(os.path.join(dir, name)):
+      try:
+        with open(os.path.join(dir, name)) as f:
+          result = json.load(f).get('run', {}).get('result')
+        if result:
+          return '%s: %d files, %d folders' % (name, result['total_files'], result['total_dirs'])
+      except (ValueError, KeyError, AttributeError):
+        pass
+      return name
+  if manifest_path:
+    with open(manifest_path) as f:
+      if f.readline().startswith('# randfiles '):
+        for line in f:
+          if not line.startswith('#'):
+            if os.path.lexists(os.path.join(dir, line.rstrip('\n').split('\t', 3)[-1])):
+              return 'manifest %s' % manifest_path
+            break
+  return None
+
+
+def delete_tree(root, threads=16, manifest_path=None):
+  """ Removes everything below root, but not root itself, with a pool of threads.
+      The files of a manifest are unlinked first, without reading any directory. The rest is found by a
+      parallel scandir walk, deepest directories first, with a bounded number of directories in flight,
+      so memory depends on depth and width of the tree, not on the number of files. A directory is
+      removed, when its subdirectories are. Everything is relative to directory file descriptors, one
+      per directory in progress, so neither PATH_MAX nor RLIMIT_NOFILE get in the way.
+      Returns (files, dirs, errors, unlink histogram, rmdir histogram).
+  """
+  rootfd = os.open(root, O_DIR)
+  pool = concurrent.futures.ThreadPoolExecutor(max(1, threads))
+  limit = 4 * max(1, threads)
+  unlink_hist, rmdir_hist = Histogram(), Histogram()
+  files = dirs = errors = 0
+
+  if manifest_path:
+    mdirs = []
+    inflight = set()
+    batch = []
+    for line in itertools.chain(open(manifest_path), [None]):
+      if line is not None:
+        if line.startswith('#'):
+          continue
+        kind, size, hash, path = line.rstrip('\n').split('\t', 3)
+        if kind == 'd':
+          mdirs.append(path)
+        else:
+          batch.append(path)
+      if len(batch) >= 1000 or (line is None and batch):
+        inflight.add(pool.submit(delete_files, rootfd, batch))
+        batch = []
+      while inflight and (len(inflight) >= limit or line is None):
+        done, inflight = concurrent.futures.wait(inflight, return_when=concurrent.futures.FIRST_COMPLETED)
+        for fut in done:
+          files += fut.result()[1]
+          unlink_hist.merge(fut.result()[3])
+    for path in reversed(mdirs):      # creation order is breadth first, so children go first.
+      t = time.perf_counter()
+      try:
+        os.rmdir(path, dir_fd=rootfd)
+        dirs += 1
+      except OSError:
+        pass          # not empty, the walk below finds out why.
+      rmdir_hist.add(time.perf_counter() - t)
+
+  # rel -> [subdirectories not removed yet, parent]. Only directories in progress are in here.
+  left = {'': [1, None]}
+  stack = ['']
+  inflight = {}
+  while stack or inflight:
+    while stack and len(inflight) < limit:
+      rel = stack.pop()
+      inflight[pool.submit(delete_scan, rootfd, rel)] = rel
+    done, _ = concurrent.futures.wait(inflight, return_when=concurrent.futures.FIRST_COMPLETED)
+    for fut in done:
+      rel = inflight.pop(fut)
+      try:
+        subdirs, f, e, hist = fut.result()
+      except OSError:
+        subdirs, f, e, hist = [], 0, 1, None
+      files += f
+      errors += e
+      if hist:
+        unlink_hist.merge(hist)
+      left[rel][0] += len(subdirs) - 1
+      for sub in subdirs:
+        left[sub] = [1, rel]
+      stack.extend(subdirs)
+      while rel and not left[rel][0]:
+        # all below is gone, remove rel, and maybe its parent.
+        parent = left.pop(rel)[1]
+        t = time.perf_counter()
+        try:
+          pfd = open_rel(rootfd, parent)
+          try:
+            os.rmdir(rel.rsplit('/', 1)[-1], dir_fd=pfd)
+            dirs += 1
+          finally:
+            os.close(pfd)
+        except OSError:
+          errors += 1
+        rmdir_hist.add(time.perf_counter() - t)
+        left[parent][0] -= 1
+        rel = parent
+  pool.shutdown()
+  os.close(rootfd)
+  return files, dirs, errors, unlink_hist, rmdir_hist
+
+
+def rmchain(fd, name):
+  """ Remove a chain of directories all called name, where fd is the deepest one (and is closed).
+      Climbs up via '..', so that only one file descriptor is held at any time.
+  """
+  while True:
+    parent = os.open('..', O_DIR, dir_fd=fd)
+    os.close(fd)
+    fd = parent
     try:
-      os.makedirs(path)
-    except:
-      print("makedirs() with short folder names:    limit exceeded at depth=%d (...+%d), pathlen=%d" % (d-incr+1, incr-1, len(path)))
+      os.rmdir(name, dir_fd=fd)
+    except FileNotFoundError:     # reached the top, whose name is not name.
+      os.close(fd)
+      return
+
+
+class Histogram:
+  """ Latencies in seconds, counted HDR style in nanoseconds: 8 buckets per power of two, by the
+      3 bits below the highest. Constant memory, percentiles are off by less than 12.5%.
+  """
+  def __init__(self):
+    self.counts = {}
+    self.n = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def add(self, t):
+    ns = int(t * 1e9)
+    e = ns.bit_length()
+    b = e << 3 | ns >> (e - 4) & 7 if e > 4 else ns
+    self.counts[b] = self.counts.get(b, 0) + 1
+    self.n += 1
+    self.sum += t
+    if t > self.max:
+      self.max = t
+
+  @staticmethod
+  def upper(b):
+    # upper edge of bucket b, in seconds.
+    if b < 16:
+      return (b + 1) * 1e-9
+    return ((b & 7 | 8) + 1 << (b >> 3) - 4) * 1e-9
+
+  def copy(self):
+    h = Histogram()
+    h.counts = self.counts.copy()      # atomic, while a writer thread may add.
+    h.n, h.sum, h.max = self.n, self.sum, self.max
+    return h
+
+  def minus(self, prev):
+    # what was added since the copy prev. The max is estimated from the buckets.
+    h = Histogram()
+    h.counts = dict((b, c - prev.counts.get(b, 0)) for b, c in self.counts.items() if c > prev.counts.get(b, 0))
+    h.n = self.n - prev.n
+    h.sum = self.sum - prev.sum
+    h.max = min(self.max, self.upper(max(h.counts))) if h.counts else 0.0
+    return h
+
+  def merge(self, other):
+    for b, c in other.counts.items():
+      self.counts[b] = self.counts.get(b, 0) + c
+    self.n += other.n
+    self.sum += other.sum
+    self.max = max(self.max, other.max)
+
+  def percentile(self, p):
+    # upper edge of the bucket, that holds the p-th percentile.
+    todo = p / 100 * self.n
+    for b in sorted(self.counts):
+      todo -= self.counts[b]
+      if todo <= 0:
+        return min(self.max, self.upper(b))
+    return self.max
+
+  def summary(self):
+    # milliseconds
+    ms = lambda t: round(t * 1000, 3)
+    return {'count': self.n, 'mean_ms': ms(self.sum / max(1, self.n)), 'p50_ms': ms(self.percentile(50)),
+            'p90_ms': ms(self.percentile(90)), 'p99_ms': ms(self.percentile(99)), 'max_ms': ms(self.max)}
+
+
+def search_limit(ok, hi):
+  """ Largest n in 1..hi, for which ok(n) holds, 0 if none. ok must be monotonic.
+      Doubles n until it fails, then bisects: O(log n) probes instead of n/incr.
+  """
+  lo, n = 0, 1
+  while True:
+    n = min(n, hi)
+    if not ok(n):
       break
+    lo = n
+    if n == hi:
+      return hi
+    n *= 2
+  while n - lo > 1:
+    mid = (lo + n) // 2
+    if ok(mid):
+      lo = mid
+    else:
+      n = mid
+  return lo
+
+
+def peak_rss_kb(who='self'):
+  try:
+    import resource     # not on windows
+  except ImportError:
+    return None
+  rss = resource.getrusage(resource.RUSAGE_CHILDREN if who == 'children' else resource.RUSAGE_SELF).ru_maxrss
+  if sys.platform == 'darwin':
+    rss = rss // 1024   # bytes, not kilobytes there.
+  return rss
+
+
+ops = ('mkdir', 'open', 'write', 'close', 'put') + tuple(op for op in workload_ops if op != 'mkdir')
+op_local = threading.local()
+op_all = []             # the histograms of all threads of this process.
+
+
+def op_hist():
+  """ The latency histograms per operation of the calling thread. No locking on the hot path,
+      other threads only read them via op_snapshot().
+  """
+  try:
+    return op_local.hists
+  except AttributeError:
+    op_local.hists = dict((op, Histogram()) for op in ops)
+    op_all.append(op_local.hists)
+    return op_local.hists
+
+
+def op_snapshot():
+  # merged over all threads of this process.
+  total = dict((op, Histogram()) for op in ops)
+  for hists in list(op_all):
+    for op in ops:
+      total[op].merge(hists[op].copy())
+  return total
+
+
+class DirFds:
+  """ Open directory file descriptors for queued directory records (parent, name, depth), for --engine dirfd.
+      Each directory is opened relative to its parent, so no long path is ever resolved.
+      Breadth first order visits siblings one after the other, a few recently used ones are kept open.
+  """
+  def __init__(self, size=64, before_close=None):
+    self.size = max(2, size)
+    self.fds = OrderedDict()      # id(record) -> (record, fd). Keeping the record keeps its id() unique.
+    self.before_close = before_close
+
+  def get(self, d):
+    chain = []
+    while d and id(d) not in self.fds:
+      chain.append(d)
+      d = d[0]
+    fd = None
+    if d:
+      self.fds.move_to_end(id(d))
+      fd = self.fds[id(d)][1]
+    for d in reversed(chain):
+      fd = os.open(d[1], O_DIR, dir_fd=fd) if fd is not None else os.open(d[1], O_DIR)
+      self.fds[id(d)] = (d, fd)
+      while len(self.fds) > self.size:
+        if self.before_close:
+          self.before_close()     # pending writes may still use the fd.
+        os.close(self.fds.popitem(last=False)[1][1])
+    return fd
+
+  def close(self):
+    if self.before_close:
+      self.before_close()
+    for d, fd in self.fds.values():
+      os.close(fd)
+    self.fds.clear()
+
+
+def dir_open(dir):
+  """ Open a directory path one name at a time. For workers, which only get the path string. """
+  fd = None
+  for name in dir.split('/'):
+    sub = os.open(name, O_DIR, dir_fd=fd) if fd is not None else os.open(name, O_DIR)
+    if fd is not None:
+      os.close(fd)
+    fd = sub
+  return fd
+
+
+def create_file(dir, name, body, flags=O_CREATE):
+  # dir is a path, or a directory file descriptor with --engine dirfd.
+  # body is a memoryview, or one of LongBody, HoleBody.
+  h = op_hist()
+  t0 = time.perf_counter()
+  if isinstance(dir, int):
+    fd = os.open(name, flags, 0o666, dir_fd=dir)
   else:
-    print(  "makedirs() with short folder names:    (maxdepth=%d done; pathlen=%d)" % (testdepth, len(path)))
-  myrmtree(testfolder)
+    fd = os.open(dir + '/' + name, flags, 0o666)
+  t1 = time.perf_counter()
+  h['open'].add(t1 - t0)
+  try:
+    if isinstance(body, memoryview):
+      write_all(fd, body)
+    else:
+      body.write(fd)
+  finally:
+    t2 = time.perf_counter()
+    h['write'].add(t2 - t1)
+    os.close(fd)
+    h['close'].add(time.perf_counter() - t2)
 
-  for d in range(testwidth):
-    path = testfolder + ("/f_%08d" % d)
-    try:
-      os.makedirs(path)
-    except:
-      print("makedirs() with many sibling folders:  limit exceeded with number_of_siblings=%d" % (d))
-      break
+
+def make_dir(dir, name):
+  t0 = time.perf_counter()
+  if isinstance(dir, int):
+    os.mkdir(name, dir_fd=dir)
   else:
-    print(  "makedirs() with many sibling folders:  (testwidth=%d done)" % (testwidth))
-  myrmtree(testfolder)
+    os.mkdir(dir + '/' + name)
+  op_hist()['mkdir'].add(time.perf_counter() - t0)
 
-  sys.exit(0)
 
+class Siblings:
+  """ Name checks for writers that do not create an entry right away. Like on disk, a name can only
+      be a folder once, and a file cannot replace a folder. The collision is raised by file() or mkdir()
+      at once, so that it is counted like with SimpleWriter.
+  """
+  dir = None
+  names = {}
 
-random.seed(conf['seed'])
-corpus = ''.join(random.choice(string.ascii_letters + string.digits) for _ in range(conf['corpus_size']))
+  def _check(self, dir, name, kind):
+    # only siblings can collide, so only the names of the current directory are kept.
+    if dir != self.dir:
+      self.dir = dir
+      self.names = {}
+    if self.names.get(name) == 'd':
+      raise (IsADirectoryError if kind == 'f' else FileExistsError)('%s/%s' % (dir, name))
+    if kind == 'd' and name in self.names:
+      raise FileExistsError('%s/%s' % (dir, name))
+    self.names[name] = kind
 
 
-def randstr(min_len=10, max_len=200):
-  len = random.randint(min_len, max_len)
-  len = min(len, conf['corpus_size'])
-  start = random.randint(0, conf['corpus_size']-len)
-  return corpus[start:start+len]
+class SimpleWriter:
+  """ Writes each file right away. Errors are raised to the caller. """
+  name = 'simple'
+  errors = 0
+  failed = ()
 
+  def file(self, dir, name, body):
+    create_file(dir, name, body)
 
-def randfile():
-  name = randstr(conf['min_name_len'], conf['max_name_len'])
-  body = randstr(conf['min_body_len'], conf['max_body_len'])
-  if 'suffix' in conf: name = name + conf['suffix']
-  return (name, body)
+  def mkdir(self, dir, name):
+    make_dir(dir, name)
 
+  def drain(self):
+    pass
 
-def randfolder():
-  name = randstr(conf['min_name_len'], conf['max_name_len'])
-  return name
+  def close(self):
+    pass
 
 
-dirs = [['.']]
+class ThreadWriter(Siblings):
+  """ Hands file creates over to a pool of threads in batches. The GIL is released during
+      open/write/close, so several creates are in flight. Errors of the creates are only counted,
+      in self.errors, and named in self.failed. Name collisions in the current directory are
+      raised right away.
 
-total_files = 0
-total_dirs = 0
-emerg_dirs = 0
-mkdir_err = 0
-open_err = 0
-max_depth = 0
+      Files are sharded over the threads by name. Files with the same name go to the same thread,
+      in order, so the last one wins like with SimpleWriter.
+  """
+  name = 'threads'
+  batch_size = 256
 
-done = 0
-while not done:
-  dirv = dirs.pop(0)
-  dir = '/'.join(dirv)
-  if len(dirv) > max_depth:
-    max_depth = len(dirv)
+  def __init__(self, threads=16):
+    n = max(1, threads)
+    self.queues = [queue.Queue(maxsize=4) for _ in range(n)]
+    self.batches = [[] for _ in range(n)]
+    self.errs = [0] * n
+    self.failed = []
+    self.threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(n)]
+    for t in self.threads:
+      t.start()
 
-  for i in range(random.randint(conf['min_entries_per_dir'], conf['max_entries_per_dir'])):
-    if total_files + total_dirs >= conf['maxfiles']:
-      done = 1
-      break
-    if random.random() > conf['folder_ratio'] * 0.01:   # percent
-      f = randfile()
+  @property
+  def errors(self):
+    return sum(self.errs)
+
+  def _run(self, i):
+    q = self.queues[i]
+    while True:
+      batch = q.get()
+      if batch is None:
+        q.task_done()
+        return
+      for dir, name, body in batch:
+        try:
+          create_file(dir, name, body)
+        except:
+          self.errs[i] += 1
+          self.failed.append(name)
+      q.task_done()
+
+  def file(self, dir, name, body):
+    self._check(dir, name, 'f')
+    i = hash(name) % len(self.queues)
+    b = self.batches[i]
+    b.append((dir, name, body))
+    if len(b) >= self.batch_size:
+      self.queues[i].put(b)
+      self.batches[i] = []
+
+  def mkdir(self, dir, name):
+    self._check(dir, name, 'd')
+    try:
+      make_dir(dir, name)
+    except FileExistsError:
+      # after --resume, the name can be on disk from before the interruption.
+      st = os.stat(name, dir_fd=dir) if isinstance(dir, int) else os.stat(dir + '/' + name)
+      self.names[name] = 'd' if stat.S_ISDIR(st.st_mode) else 'f'
+      raise
+
+  def drain(self):
+    for i, q in enumerate(self.queues):
+      if self.batches[i]:
+        q.put(self.batches[i])
+        self.batches[i] = []
+    for q in self.queues:
+      q.join()
+    self.dir = None
+
+  def close(self):
+    self.drain()
+    for q in self.queues:
+      q.put(None)
+    for t in self.threads:
+      t.join()
+
+
+def open_output(target):
+  """ The stream for --tar FILE or --zip FILE: "-" for stdout, tcp://HOST:PORT, or a file.
+      With "-", print() goes to stderr from then on. Raises OSError or ValueError.
+  """
+  if target == '-':
+    out = sys.stdout.buffer
+    sys.stdout = sys.stderr         # progress and summary must not end up in the archive.
+    return out
+  if target.startswith('tcp://'):
+    host, port = target[6:].rsplit(':', 1)
+    return socket.create_connection((host.strip('[]'), int(port))).makefile('wb')
+  return open(target, 'wb')
+
+
+class ArchiveWriter(Siblings):
+  """ --tar, --zip: writes the entries to an archive stream in creation order, below a top folder
+      named like DIR. Nothing is written to DIR. Tar needs constant memory, zip keeps a small record
+      per entry for its central directory.
+      Like on disk, a name can only be a folder once, and a file cannot replace a folder.
+      A file name repeated in a directory is in the archive twice, extracting keeps the last one.
+  """
+  errors = 0
+  failed = ()
+
+  def __init__(self, kind, out, top):
+    self.name = kind
+    self.out = out
+    self.top = top
+    self.mtime = int(time.time())
+    self.pos = 0
+    self.zip = zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED, allowZip64=True) if kind == 'zip' else None
+    self._add(top, None)
+
+  def _write(self, data):
+    self.out.write(data)
+    self.pos += len(data)
+
+  def _add(self, path, body):
+    # body None is a folder.
+    try:
+      if self.zip:
+        zi = zipfile.ZipInfo(path + '/' if body is None else path, time.localtime(self.mtime)[:6])
+        if body is None:
+          zi.external_attr = 0o40755 << 16 | 0x10
+          self.zip.writestr(zi, b'')
+        else:
+          zi.external_attr = 0o100644 << 16
+          zi.file_size = len(body)
+          with self.zip.open(zi, 'w') as o:
+            for chunk in body_chunks(body):
+              o.write(chunk)
+        return
+      ti = tarfile.TarInfo(path)
+      ti.mtime = self.mtime
+      if body is None:
+        ti.type, ti.mode = tarfile.DIRTYPE, 0o755
+      else:
+        ti.size, ti.mode = len(body), 0o644
+      self._write(ti.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape'))
+      if body is not None:
+        for chunk in body_chunks(body):
+          self._write(chunk)
+        self._write(zeros[:-len(body) % tarfile.BLOCKSIZE])
+    except OSError as e:
+      # the callers count and skip failed entries, but a broken stream ends the run.
+      print("ERROR: --%s: %s" % (self.name, e), file=sys.stderr)
+      os._exit(1)
+
+  def file(self, dir, name, body):
+    self._check(dir, name, 'f')
+    self._add(self.top + (dir + '/' + name)[1:], body)
+
+  def mkdir(self, dir, name):
+    self._check(dir, name, 'd')
+    self._add(self.top + (dir + '/' + name)[1:], None)
+
+  def drain(self):
+    pass
+
+  def close(self):
+    pass
+
+  def finish(self):
+    # after the .conf file, which is the last entry.
+    try:
+      if self.zip:
+        self.zip.close()
+      else:
+        self._write(bytes(2 * tarfile.BLOCKSIZE))
+        self._write(bytes(-self.pos % tarfile.RECORDSIZE))
+      self.out.flush()
+    except OSError as e:
+      print("ERROR: --%s: %s" % (self.name, e), file=sys.stderr)
+      sys.exit(1)
+
+
+class DavClient:
+  """ HTTP/1.1 requests to the server of a --dav URL http[s]://[USER:PASS@]HOST[:PORT]/PATH, with Basic auth.
+      A connection is a list of one http.client connection, so that it can be replaced.
+  """
+  def __init__(self, url):
+    self.url = url
+    self.headers = {}
+    if url.username is not None:
+      auth = urllib.parse.unquote(url.username) + ':' + urllib.parse.unquote(url.password or '')
+      self.headers['Authorization'] = 'Basic ' + base64.b64encode(auth.encode()).decode()
+
+  def connect(self):
+    if self.url.scheme == 'https':
+      return [http.client.HTTPSConnection(self.url.hostname, self.url.port, timeout=60)]
+    return [http.client.HTTPConnection(self.url.hostname, self.url.port, timeout=60)]
+
+  def request(self, conn, method, path, body=None, op=None):
+    """ Returns the HTTP status. A keep-alive connection, that the server has closed meanwhile, is reopened once.
+        With op, the latency is kept as that operation.
+    """
+    headers = dict(self.headers)
+    if body is not None:
+      headers['Content-Length'] = str(len(body))
+    for retry in (1, 0):
+      start = time.perf_counter()
       try:
-        fd = open(dir + '/' + f[0], 'w')
-        fd.write(f[1])
-        fd.close()
-        total_files += 1
+        conn[0].request(method, path, body_chunks(body) if body is not None else None, headers)
+        r = conn[0].getresponse()
+        r.read()
+        if op:
+          op_hist()[op].add(time.perf_counter() - start)
+        return r.status
+      except (http.client.RemoteDisconnected, http.client.CannotSendRequest, ConnectionError):
+        conn[0].close()
+        if not retry:
+          raise
+        conn[:] = self.connect()
+
+
+class DavWriter(Siblings):
+  """ --dav URL: creates the tree on a WebDAV server, below URL, in a top folder named like DIR.
+      Folders are created right away with MKCOL, on a connection of their own. Files are PUT in batches
+      by a pool of threads, each with one HTTP/1.1 keep-alive connection. Errors of the PUTs are only
+      counted, in self.errors and self.failed. Sharded by name, and name collisions are raised right away,
+      like ThreadWriter.
+      Latencies are kept as operations 'mkdir' and 'put'.
+  """
+  name = 'dav'
+  batch_size = 64
+
+  def __init__(self, url, top, threads=16):
+    n = max(1, threads)
+    self.dav = DavClient(url)
+    self.base = url.path.rstrip('/') + '/' + urllib.parse.quote(top)
+    self.queues = [queue.Queue(maxsize=4) for _ in range(n)]
+    self.batches = [[] for _ in range(n)]
+    self.errs = [0] * n
+    self.failed = []
+    self.conn = self.dav.connect()
+    status = self.dav.request(self.conn, 'MKCOL', self.base, None, 'mkdir')
+    if status not in (201, 405):        # 405: exists already, fine for the top folder.
+      raise OSError("MKCOL %s: HTTP %d" % (self.base, status))
+    self.threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(n)]
+    for t in self.threads:
+      t.start()
+
+  @property
+  def errors(self):
+    return sum(self.errs)
+
+  def _path(self, dir, name):
+    # dir starts with '.'
+    return self.base + urllib.parse.quote((dir + '/' + name)[1:])
+
+  def _run(self, i):
+    q = self.queues[i]
+    conn = self.dav.connect()
+    while True:
+      batch = q.get()
+      if batch is None:
+        conn[0].close()
+        q.task_done()
+        return
+      for path, name, body in batch:
+        try:
+          if self.dav.request(conn, 'PUT', path, body, 'put') // 100 != 2:
+            self.errs[i] += 1
+            self.failed.append(name)
+        except:
+          self.errs[i] += 1
+          self.failed.append(name)
+          conn[0].close()
+          conn[:] = self.dav.connect()
+      q.task_done()
+
+  def file(self, dir, name, body):
+    self._check(dir, name, 'f')
+    i = hash(name) % len(self.queues)
+    b = self.batches[i]
+    b.append((self._path(dir, name), name, body))
+    if len(b) >= self.batch_size:
+      self.queues[i].put(b)
+      self.batches[i] = []
+
+  def mkdir(self, dir, name):
+    self._check(dir, name, 'd')
+    path = self._path(dir, name)
+    status = self.dav.request(self.conn, 'MKCOL', path, None, 'mkdir')
+    if status == 405:
+      raise FileExistsError(path)
+    if status // 100 != 2:
+      raise OSError("MKCOL %s: HTTP %d" % (path, status))
+
+  def drain(self):
+    for i, q in enumerate(self.queues):
+      if self.batches[i]:
+        q.put(self.batches[i])
+        self.batches[i] = []
+    for q in self.queues:
+      q.join()
+    self.dir = None
+
+  def close(self):
+    # the .conf file is still PUT after this.
+    self.drain()
+
+  def finish(self):
+    self.drain()
+    for q in self.queues:
+      q.put(None)
+    for t in self.threads:
+      t.join()
+    self.conn[0].close()
+
+
+def schedule_rate(points, t):
+  # piecewise linear between the points, constant before the first and after the last.
+  if t <= points[0][0]:
+    return points[0][1]
+  for (t0, r0), (t1, r1) in zip(points, points[1:]):
+    if t < t1:
+      return r0 + (r1 - r0) * (t - t0) / (t1 - t0)
+  return points[-1][1]
+
+
+class Pacer:
+  """ Token buckets for --rate (entries) and --rate_mb (bytes). take() sleeps until the entry is due.
+      Tokens not used for up to burst seconds can be spent at once, no more, so an idle phase is not
+      followed by a storm. The due times are in shared memory, created before the fork, so that the -j
+      workers and the --workload threads take from the same buckets.
+  """
+  burst = 0.1
+
+  def __init__(self, files, mb):
+    # [schedule, units per rate, bytes or entries, due time]
+    self.buckets = [[sched, unit, by_bytes, multiprocessing.Value('d', 0.0)]
+                    for sched, unit, by_bytes in ((files, 1, False), (mb, 1e6, True)) if sched]
+
+  def take(self, nbytes):
+    for sched, unit, by_bytes, shared in self.buckets:
+      while True:
+        now = time.time()
+        rate = schedule_rate(sched, now - start_time) * unit
+        if rate > 0:
+          break
+        time.sleep(self.burst)     # ramping up from 0
+      with shared.get_lock():
+        shared.value = due = max(shared.value, now - self.burst) + (nbytes if by_bytes else 1) / rate
+      if due > now:
+        time.sleep(due - now)
+
+
+pacer = None
+
+def get_pacer():
+  # The first call has to be before the fork, the -j workers share it.
+  global pacer
+  if pacer is None and (rate_files or rate_mb):
+    pacer = Pacer(rate_files, rate_mb)
+  return pacer
+
+
+writer = None
+
+def get_writer():
+  # Created on first use, so that each -j worker starts its own threads after the fork.
+  global writer
+  if writer is None:
+    if archive:
+      writer = ArchiveWriter(archive, archive_out, os.path.basename(os.path.abspath(args.dir)))
+    elif args.dav:
+      try:
+        writer = DavWriter(dav_url, os.path.basename(os.path.abspath(args.dir)), args.writer_threads)
+      except (OSError, http.client.HTTPException) as e:
+        print("ERROR: --dav %s: %s" % (args.dav, e))
+        sys.exit(1)
+    elif args.writer == 'threads':
+      writer = ThreadWriter(args.writer_threads)
+    else:
+      writer = SimpleWriter()
+  return writer
+
+
+def mkdir_seen(mkdir, dir, name, seen):
+  """ After --resume, a directory may have been populated partly before the interruption.
+      Its folders exist then, which is fine. Only a name already used in this directory since
+      the resume, or a file, is a real collision, and fails like it would have in an uninterrupted run.
+  """
+  try:
+    mkdir(dir, name)
+  except FileExistsError:
+    if name in seen:
+      raise
+    st = os.stat(name, dir_fd=dir) if isinstance(dir, int) else os.stat(dir + '/' + name)
+    if not stat.S_ISDIR(st.st_mode):
+      raise
+  seen.add(name)
+
+
+def queue_from_paths(paths):
+  # rebuild the (parent, name, depth) records of a checkpoint, sharing the parents again.
+  recs = {}
+  q = deque()
+  for path in paths:
+    d = None
+    key = ''
+    for name in path.split('/'):
+      key += '/' + name
+      if key not in recs:
+        recs[key] = (d, name, d[2]+1 if d else 1)
+      d = recs[key]
+    q.append(d)
+  return q
+
+
+def save_checkpoint(state):
+  state['conf'] = dict((k, v) for k, v in conf.items() if k != 'run')
+  state['args'] = {'engine': args.engine, 'writer': args.writer, 'writer_threads': args.writer_threads,
+                   'jobs': jobs if conf['stream'] != 'legacy' else None, 'manifest': args.manifest}
+  state['manifest_offset'] = manifest.tell() if manifest else None
+  state['resumed'] = resumed
+  tmp = ckptfile + '.tmp'
+  o = open(tmp, 'w')
+  json.dump(state, o)
+  o.close()
+  os.replace(tmp, ckptfile)     # atomic, a crash while saving leaves the previous one.
+
+
+progress = None         # with --stats: files, dirs, bytes of the directories being populated, shared with the -j workers.
+
+def progress_add(files, dirs, nbytes):
+  with progress.get_lock():
+    progress[0] += files
+    progress[1] += dirs
+    progress[2] += nbytes
+
+
+def populate_dir(dir, count, tick=False):
+  """ Create count entries in directory dir, using the generator of stream 'perdir' or 'numpy'.
+      Runs in a worker process with -j, else with tick, which emits the --stats lines that are due between entries.
+      Returns (subdirs, files, dirs, open_err, mkdir_err, bytes, manifest_lines,
+      rng_seconds, (pid, latency histograms of the process)).
+  """
+  t = time.perf_counter()
+  entries = iter(dir_entries(dir, count))
+  rng_s = time.perf_counter() - t
+  dirh = dir_open(dir) if args.engine == 'dirfd' else dir
+  w = get_writer()
+  p = get_pacer()
+  errors = w.errors
+  seen = set() if resumed else None
+  lines = [] if args.manifest else None
+  subdirs = []
+  files = open_err = mkdir_err = nbytes = 0
+  for i in range(count):
+    t = time.perf_counter()
+    f = next(entries)
+    rng_s += time.perf_counter() - t
+    if type(f) is tuple:
+      if seen is not None:
+        seen.add(f[0])
+      if p:
+        p.take(len(f[1]))
+      try:
+        w.file(dirh, f[0], f[1])
+        files += 1
+        nbytes += len(f[1])
+        if lines is not None:
+          lines.append(manifest_file(dir + '/' + f[0], f[1]))
+        if progress:
+          progress_add(1, 0, len(f[1]))
       except:
-        pass
+        open_err += 1
     else:
-      f = randfolder()
+      if p:
+        p.take(0)
       try:
-        os.mkdir(dir + '/' + f)
-        dirs.append(dirv+[f])
-        total_dirs += 1
+        if seen is not None:
+          mkdir_seen(w.mkdir, dirh, f, seen)
+        else:
+          w.mkdir(dirh, f)
+        subdirs.append(f)
+        if lines is not None:
+          lines.append(manifest_dir(dir + '/' + f))
+        if progress:
+          progress_add(0, 1, 0)
       except:
+        mkdir_err += 1
+    if tick and stats_due():
+      emit_stats()
+  w.drain()
+  errors = w.errors - errors
+  if progress and errors:
+    progress_add(-errors, 0, 0)
+  if lines:
+    lines = manifest_created(lines, w)
+  if args.engine == 'dirfd':
+    os.close(dirh)
+  return (subdirs, files - errors, len(subdirs), open_err + errors, mkdir_err, nbytes, lines, rng_s, (os.getpid(), op_snapshot()))
+
+
+class Workload:
+  """ --workload: runs a mix of operations on the files and folders of an existing tree, with a pool of threads.
+      Threads share the lists of this process, and pick from them under the lock. A file is taken out of the
+      list, while it is renamed or unlinked, so that two threads never rename or unlink the same file.
+      Operations that lose a race with that (ENOENT on a picked file), or hit a name that exists (EEXIST),
+      are skipped, not errors, and change nothing. With no file left, an operation is not done at all.
+      With -j each process owns every jobs-th file, the folders of the tree are shared, new ones stay with
+      the process that created them.
+  """
+  class Empty(Exception):
+    pass
+
+  def __init__(self, files, dirs, seed):
+    self.files = files
+    self.dirs = dirs            # shared by the -j processes, never changed.
+    self.new_dirs = []
+    self.seed = seed
+    self.lock = threading.Lock()
+    self.names = [op for op, w in mix]
+    self.weights = list(itertools.accumulate(w for op, w in mix))
+    self.errs = dict((op, 0) for op in workload_ops)
+    self.skipped = dict((op, 0) for op in workload_ops)
+    self.done = 0
+
+  def _pick(self, rng):
+    with self.lock:
+      if not self.files:
+        raise self.Empty()
+      return self.files[rng.randrange(len(self.files))]
+
+  def _pick_dir(self, rng):
+    with self.lock:
+      i = rng.randrange(len(self.dirs) + len(self.new_dirs))
+      return self.dirs[i] if i < len(self.dirs) else self.new_dirs[i - len(self.dirs)]
+
+  def _take(self, rng):
+    with self.lock:
+      if not self.files:
+        raise self.Empty()
+      i = rng.randrange(len(self.files))
+      self.files[i], self.files[-1] = self.files[-1], self.files[i]
+      return self.files.pop()
+
+  def _new(self, rng, suffix=''):
+    return self._pick_dir(rng) + '/' + randstr(conf['min_name_len'], conf['max_name_len'], rng) + suffix
+
+  def stat(self, rng):
+    with self.lock:
+      n = len(self.files)
+    os.stat(self._pick(rng) if rng.random() * (n + len(self.dirs) + len(self.new_dirs)) < n else self._pick_dir(rng))
+
+  def read(self, rng):
+    fd = os.open(self._pick(rng), os.O_RDONLY)
+    try:
+      while os.read(fd, 1024*1024):
         pass
-  while len(dirs) == 0:
-    # all entries all folders were files. That is rare, but must not kill us.
-    # let us have one emergency folder.
-    f = randfolder()
+    finally:
+      os.close(fd)
+
+  def overwrite(self, rng):
+    create_file('.', self._pick(rng), randbody(conf['min_body_len'], conf['max_body_len'], rng), O_OVERWRITE)
+
+  def rename(self, rng):
+    # link and unlink, as os.rename() would silently replace a file of the new name.
+    path = self._take(rng)
+    new = os.path.dirname(path) + '/' + randstr(conf['min_name_len'], conf['max_name_len'], rng) + conf.get('suffix', '')
     try:
-      os.mkdir(dir + '/' + f)
-      dirs.append(dirv+[f])
-      total_dirs += 1
-      emerg_dirs += 1
-      break
+      os.link(path, new)
+      os.unlink(path)
+      path = new
+    finally:
+      with self.lock:
+        self.files.append(path)
+
+  def unlink(self, rng):
+    path = self._take(rng)
+    try:
+      os.unlink(path)
     except:
-      pass
+      with self.lock:
+        self.files.append(path)
+      raise
 
-  print("%d files done. depth: %d" % (total_files, max_depth))
+  def mkdir(self, rng):
+    path = self._new(rng)
+    os.mkdir(path)
+    with self.lock:
+      self.new_dirs.append(path)
 
+  def create(self, rng):
+    path = self._new(rng, conf.get('suffix', ''))
+    create_file('.', path, randbody(conf['min_body_len'], conf['max_body_len'], rng), O_NEW)
+    with self.lock:
+      self.files.append(path)
 
-print("total_files: ", total_files)
-print("total_dirs:  ", total_dirs)
-print("max_depth:   ", max_depth)
-print("emerg_dirs:  ", emerg_dirs)
-print("mkdir_err:   ", mkdir_err)
-print("open_err:    ", open_err)
-print("seed:        ", conf['seed'])
+  def _run(self, t, nops, deadline):
+    rng = random.Random(self.seed + '\0workload%d' % t)
+    h = op_hist()
+    p = get_pacer()
+    errs = dict((op, 0) for op in workload_ops)
+    skipped = dict((op, 0) for op in workload_ops)
+    done = 0
+    for i in range(nops):
+      if deadline and time.time() > deadline:
+        break
+      op = rng.choices(self.names, cum_weights=self.weights)[0]
+      if p:
+        p.take(0)
+      start = time.perf_counter()
+      try:
+        getattr(self, op)(rng)
+      except self.Empty:
+        skipped[op] += 1
+        continue
+      except (FileNotFoundError, FileExistsError) as e:
+        if isinstance(e, FileNotFoundError) and op not in ('stat', 'read', 'overwrite'):
+          errs[op] += 1
+        else:
+          skipped[op] += 1
+      except OSError:
+        errs[op] += 1
+      h[op].add(time.perf_counter() - start)
+      done += 1
+    with self.lock:
+      self.done += done
+      for op in workload_ops:
+        self.errs[op] += errs[op]
+        self.skipped[op] += skipped[op]
 
-conf['run']['result'] = {
-  'total_files': total_files,
-  'total_dirs': total_dirs,
-  'max_depth': max_depth,
-  'emerg_dirs': emerg_dirs,
-  'mkdir_err': mkdir_err,
-  'open_err': open_err,
-}
+  def run(self, nops, deadline, threads):
+    threads = max(1, threads)
+    pool = [threading.Thread(target=self._run, args=(t, nops // threads + (t < nops % threads), deadline)) for t in range(threads)]
+    for t in pool:
+      t.start()
+    for t in pool:
+      t.join()
+    return self.done, self.errs, self.skipped
 
-o = open(conffile, "w")
-print(json.dumps(conf, sort_keys=True, indent=4), file=o)
-o.close()
-print("... %s written." % (args.dir + '/' + conffile))
+
+# the paths of the tree. Set by run_workload() before the fork, so that the -j workers inherit them, instead of
+# getting them pickled per task.
+workload_files = None
+workload_dirs = None
+
+def workload_proc(k, nops, deadline):
+  """ One --workload process, with -T threads. Returns (ops done, errors by op, skipped by op, latency histograms). """
+  w = Workload(workload_files[k::workload_jobs], workload_dirs, conf['seed'] + '\0%d' % k)
+  done, errs, skipped = w.run(nops // workload_jobs + (k < nops % workload_jobs), deadline, args.threads)
+  return done, errs, skipped, op_snapshot()
+
+
+def run_workload(entries):
+  """ Runs --workload on the entries {path: (kind, size, hash)} of the tree in the current directory,
+      prints ops/s and the latencies per operation. Returns the number of failed operations.
+  """
+  global start_time, workload_files, workload_dirs
+  workload_files = ['./' + path for path, e in entries.items() if e[0] == 'f']
+  workload_dirs = ['.'] + ['./' + path for path, e in entries.items() if e[0] == 'd']
+  print("workload %s on %d files, %d folders, %d processes of %d threads." % (args.workload, len(workload_files), len(workload_dirs), workload_jobs, args.threads))
+  start = start_time = time.time()      # --rate schedules start with the workload.
+  deadline = start + args.duration if args.duration else None
+  get_pacer()
+  if workload_jobs > 1:
+    with multiprocessing.get_context('fork').Pool(workload_jobs) as pool:
+      results = pool.starmap(workload_proc, [(k, args.ops, deadline) for k in range(workload_jobs)])
+  else:
+    results = [workload_proc(0, args.ops, deadline)]
+  elapsed = max(time.time() - start, 1e-9)
+  total = dict((op, Histogram()) for op in ops)
+  errs = dict((op, 0) for op in workload_ops)
+  skipped = dict((op, 0) for op in workload_ops)
+  for done, e, sk, hists in results:
+    for op in ops:
+      total[op].merge(hists[op])
+    for op in workload_ops:
+      errs[op] += e[op]
+      skipped[op] += sk[op]
+  done = sum(r[0] for r in results)
+
+  print("ops:         ", done)
+  print("ops/s:       ", int(done / elapsed))
+  for op in workload_ops:
+    h = total[op]
+    if h.n:
+      print("%-13s" % (op + ' ms:'), "p50 %(p50_ms)g  p90 %(p90_ms)g  p99 %(p99_ms)g  max %(max_ms)g  (%(count)d)" % h.summary(),
+            " errors %d  skipped %d" % (errs[op], skipped[op]))
+  if args.stats:
+    with open(args.stats, 'a') as o:
+      o.write(json.dumps({'workload': args.workload, 't': round(elapsed, 3), 'ops': done, 'ops_per_s': round(done / elapsed, 1),
+                          'errors': errs, 'skipped': skipped, 'latency': dict((op, h.summary()) for op, h in total.items() if h.n)}, sort_keys=True) + '\n')
+  return sum(errs.values())
+
+
+def op_totals():
+  total = op_snapshot()
+  for pid, hists in worker_ops.items():
+    if pid != os.getpid():      # without -j, populate_dir() runs here, and is in the snapshot already.
+      for op in ops:
+        total[op].merge(hists[op])
+  return total
+
+
+def stats_due():
+  return stats_out and time.time() - last_stats['time'] >= args.stats_interval
+
+
+def emit_stats():
+  """ One JSON line to --stats: totals, and rates and latencies of the interval since the last line.
+      The totals include the directories still being populated, their latencies come when they are done.
+  """
+  global last_stats
+  now = time.time()
+  hists = op_totals()
+  dt = max(now - last_stats['time'], 1e-9)
+  files, dirs, nbytes = total_files, total_dirs, total_bytes
+  if progress:
+    files += progress[0]
+    dirs += progress[1]
+    nbytes += progress[2]
+  line = {
+    't': round(now - start_time, 3),
+    'files': files,
+    'dirs': dirs,
+    'bytes': nbytes,
+    'files_per_s': round((files + dirs - last_stats['entries']) / dt, 1),
+    'mb_per_s': round((nbytes - last_stats['bytes']) / dt / 1e6, 3),
+    'rng_s': round(rng_s + sched.rng_s, 3),
+    'latency': dict((op, h.minus(last_stats['ops'][op]).summary()) for op, h in hists.items() if h.n > last_stats['ops'][op].n),
+  }
+  stats_out.write(json.dumps(line, sort_keys=True) + '\n')
+  stats_out.flush()
+  last_stats = {'time': now, 'entries': files + dirs, 'bytes': nbytes, 'ops': hists}
+
+
+def checkpoint_due():
+  return args.checkpoint and time.time() - last_ckpt > args.checkpoint
+
+
+def checkpoint(rng_state=None):
+  global last_ckpt
+  save_checkpoint({
+    'queue': [dir_path(d) for d in sched.dirs],
+    'pending': [[dir_path(d), c] for d, c in sched.pending],
+    'counters': [total_files, total_dirs, emerg_dirs, mkdir_err, open_err, max_depth, max_queued, total_bytes, sched.planned,
+                 writer_errors + (writer.errors if writer and conf['stream'] == 'legacy' else 0), sched.done],
+    'elapsed': time.time() - start_time,
+    'random': rng_state,
+  })
+  last_ckpt = time.time()
+
+
+if __name__ == '__main__':
+  conf_run = {
+    'argv0': os.path.abspath(sys.argv[0]),
+    '__version__': __version__,
+    'when': time.ctime(),
+  }
+
+  parser = argparse.ArgumentParser(description='Create deep or shallow trees of random files.')
+  parser.add_argument('dir', metavar='DIR', type=str, help='destination folder')
+  parser.add_argument('-m', '--maxfiles', metavar='MAXFILES', type=int, help='Number of files and folders to generate. Default: ' + str(conf['maxfiles']))
+  parser.add_argument('-S', '--seed', metavar='SEED_STRING', type=str, help='String to seed the random generator. Call with identical seed to recreate an identical tree. Default: current timestamp in msec')
+  parser.add_argument('-f', '--folder_ratio', metavar='FOLDER_PERCENTAGE', type=float, help='Probability to create a subfolder instead of a file, as percent. Default: ' + str(conf['folder_ratio']))
+  parser.add_argument('-e', '--max_entries_per_dir', metavar='MAX_ENTRIES_PER_DIR', type=int, help='Maximum number files/subdirs per directory. Default: ' + str(conf['max_entries_per_dir']))
+  parser.add_argument(      '--min_entries_per_dir', metavar='MIN_ENTRIES_PER_DIR', type=int, help='Minimum number files/subdirs per directory. Default: ' + str(conf['min_entries_per_dir']))
+  parser.add_argument('-n', '--max_name_len', metavar='MAX_NAME_LEN', type=int, help='Maximum length of file/subdir names. Default: ' + str(conf['max_name_len']))
+  parser.add_argument(      '--min_name_len', metavar='MIN_NAME_LEN', type=int, help='Minimum length of file/subdir names. Default: ' + str(conf['min_name_len']))
+  parser.add_argument('-b', '--max_body_len', metavar='MAX_BODY_LEN', type=int, help='Maximum length file contents. Default: ' + str(conf['max_body_len']))
+  parser.add_argument(      '--min_body_len', metavar='MIN_BODY_LEN', type=int, help='Minimum length file contents. Default: ' + str(conf['min_body_len']))
+  parser.add_argument('-D', '--size_dist', metavar='DIST', type=str, help='Distribution of body lengths, between MIN_BODY_LEN and MAX_BODY_LEN: "uniform", "lognormal:MEDIAN:SIGMA", "pareto:ALPHA" (scaled by MIN_BODY_LEN) or "hist:FILE" with lines "UPPER_LEN WEIGHT". Default: ' + conf['size_dist'])
+  parser.add_argument(      '--body', choices=['data', 'sparse', 'fallocate'], help='File contents: "data" random bytes, "sparse" only a hole of the length, "fallocate" allocated but unwritten blocks. Default: ' + conf['body'])
+  parser.add_argument('-c', '--corpus_size', metavar='CORPUS_SIZE', type=int, help='Size of the internal random pool. (Larger is more chaotic but slower). Default: ' + str(conf['corpus_size']))
+  parser.add_argument('-L', '--load_config', metavar='CONFIG_FILE', type=str, help='Load a config file from a previous run, before applying other options. Default: none.')
+  parser.add_argument('-t', '--testonly', action='store_true', help='Only test how deep or wide a tree could be. Default: create a tree.')
+  parser.add_argument('-s', '--suffix', metavar='SUFFIX', type=str, help='Common suffix for all file names generated. Default: none')
+  parser.add_argument('-j', '--jobs', metavar='N', type=int, help='Populate directories with N worker processes. Implies per-directory seeding; the tree is identical for any N. Default: single process, legacy seeding')
+  parser.add_argument(      '--stream', choices=['legacy', 'perdir', 'numpy'], help='Random stream: "legacy" one generator for the whole tree, "perdir" one per directory, "numpy" one per directory, drawing all entries of a directory at once with NumPy. Each gives other trees for the same seed. Default: legacy, perdir with -j')
+  parser.add_argument(      '--engine', choices=['path', 'dirfd'], help='How to address directories: "path" opens DIR/sub/dir/file, "dirfd" creates relative to open directory file descriptors, allows paths beyond PATH_MAX. Default: path')
+  parser.add_argument(      '--writer', choices=['simple', 'threads'], help='How to write files: "simple" one after the other, "threads" in batches on a pool of threads. Default: simple')
+  parser.add_argument(      '--writer_threads', metavar='N', type=int, help='Number of threads for --writer threads, and of connections for --dav. Default: 16')
+  parser.add_argument(      '--checkpoint', metavar='SECONDS', type=float, default=60, help='Save progress to DIR/DIR.ckpt every SECONDS, 0 to disable. Default: 60')
+  parser.add_argument(      '--resume', action='store_true', help='Continue an interrupted run from DIR/DIR.ckpt. The result is the same tree as an uninterrupted run.')
+  parser.add_argument(      '--manifest', metavar='FILE', type=str, help='Write path, size and hash of all entries to FILE while creating. With --verify: compare against FILE. Default: none')
+  parser.add_argument(      '--verify', action='store_true', help='Do not write, compare the tree in DIR against --manifest, or against the tree of -L CONFIG_FILE (default DIR/DIR.conf) regenerated in memory.')
+  parser.add_argument('-T', '--threads', metavar='N', type=int, default=16, help='Number of threads for --verify and --workload. Default: 16')
+  parser.add_argument(      '--workload', metavar='MIX', type=str, help='Do not create, run a mix of operations on the tree in DIR, like "stat:50,read:20,overwrite:10,rename:10,unlink:5,mkdir:5" (also: create). The tree is taken from --manifest, or regenerated from -L CONFIG_FILE (default DIR/DIR.conf). With -j N: N processes of -T threads. Default: none')
+  parser.add_argument(      '--delete', action='store_true', help='Remove the tree DIR with -T threads: the files of --manifest first, if given, then whatever a parallel walk finds. Only a DIR with DIR/DIR.conf, DIR/DIR.ckpt or a matching --manifest.')
+  parser.add_argument(      '--force', action='store_true', help='With --delete: also remove a DIR that randfiles.py did not make.')
+  parser.add_argument(      '--ops', metavar='N', type=int, default=100_000, help='Number of operations for --workload. Default: 100000')
+  parser.add_argument(      '--duration', metavar='SECONDS', type=float, help='Stop --workload after SECONDS. Default: after --ops')
+  parser.add_argument(      '--tar', metavar='FILE', type=str, help='Do not write to DIR, stream the tree as a tar archive to FILE, "-" for stdout, or tcp://HOST:PORT. Default: none')
+  parser.add_argument(      '--zip', metavar='FILE', type=str, help='Like --tar, but a zip archive. Default: none')
+  parser.add_argument(      '--stats', metavar='FILE', type=str, help='Append a JSON line with rates and latency percentiles of the last interval to FILE, every --stats_interval. Default: none')
+  parser.add_argument(      '--stats_interval', metavar='SECONDS', type=float, default=1, help='Interval for --stats. Default: 1')
+  parser.add_argument(      '--rate', metavar='SCHEDULE', type=str, help='Pace to at most this many files and folders per second. A number, or a ramp "SECONDS:RATE,SECONDS:RATE,..." interpolated linearly over the run time, the last rate holds. Default: as fast as possible')
+  parser.add_argument(      '--rate_mb', metavar='SCHEDULE', type=str, help='Pace to at most this many MB per second of file bodies, like --rate. Default: as fast as possible')
+  parser.add_argument(      '--dav', metavar='URL', type=str, help='Do not write to DIR, create the tree on a WebDAV server, below URL, as http[s]://[USER:PASS@]HOST[:PORT]/PATH. Default: none')
+  args = parser.parse_args()
+
+  ckptfile = os.path.basename(os.path.abspath(args.dir))+'.ckpt'
+  ckpt = None
+  if args.manifest:
+    args.manifest = os.path.abspath(args.manifest)       # we chdir into DIR later.
+  if args.stats:
+    args.stats = os.path.abspath(args.stats)
+  archive = 'tar' if args.tar else 'zip' if args.zip else None
+  if archive:
+    if args.tar and args.zip:
+      print("ERROR: --tar and --zip do not mix.")
+      sys.exit(1)
+    if args.verify or args.resume or args.testonly:
+      print("ERROR: --%s does not mix with --verify, --resume or -t." % archive)
+      sys.exit(1)
+    target = args.tar or args.zip
+    try:
+      archive_out = open_output(target)
+    except (OSError, ValueError) as e:
+      print("ERROR: --%s %s: %s" % (archive, target, e))
+      sys.exit(1)
+  rate_files = parse_schedule('--rate', args.rate)
+  rate_mb = parse_schedule('--rate_mb', args.rate_mb)
+  if args.dav:
+    if archive or args.verify or args.resume or args.testonly:
+      print("ERROR: --dav does not mix with --tar, --zip, --verify, --resume or -t.")
+      sys.exit(1)
+    dav_url = urllib.parse.urlsplit(args.dav)
+    if dav_url.scheme not in ('http', 'https') or not dav_url.hostname:
+      print("ERROR: --dav %s: expected http[s]://[USER:PASS@]HOST[:PORT]/PATH." % args.dav)
+      sys.exit(1)
+  if args.delete:
+    if args.verify or args.workload or archive or args.dav or args.testonly or args.resume:
+      print("ERROR: --delete does not mix with --verify, --workload, --tar, --zip, --dav, -t or --resume.")
+      sys.exit(1)
+    if not os.path.isdir(args.dir):
+      print("ERROR: --delete: %s is not a directory." % args.dir)
+      sys.exit(1)
+    if not (os.unlink in os.supports_dir_fd and os.rmdir in os.supports_dir_fd):
+      print("ERROR: --delete is not supported on %s." % sys.platform)
+      sys.exit(1)
+    try:
+      made_by = made_by_randfiles(args.dir, args.manifest)
+    except OSError as e:
+      print("ERROR: --delete: --manifest %s: %s" % (args.manifest, e.strerror))
+      sys.exit(1)
+    if not made_by and not args.force:
+      print("ERROR: --delete: %s has no %s.conf, %s.ckpt or matching --manifest, randfiles.py did not make it. Use --force to delete it anyway." %
+            (args.dir, os.path.basename(os.path.abspath(args.dir)), os.path.basename(os.path.abspath(args.dir))))
+      sys.exit(1)
+  elif args.force:
+    print("ERROR: --force is only for --delete.")
+    sys.exit(1)
+  if args.workload:
+    if args.verify or archive or args.dav or args.testonly:
+      print("ERROR: --workload does not mix with --verify, --tar, --zip, --dav or -t.")
+      sys.exit(1)
+    try:
+      mix = [(op, float(w)) for op, w in (m.split(':') for m in args.workload.split(','))]
+      if not all(op in workload_ops and w >= 0 for op, w in mix) or not sum(w for op, w in mix):
+        raise ValueError
+    except ValueError:
+      print("ERROR: --workload %s: expected OP:WEIGHT,... with OP one of %s." % (args.workload, ', '.join(workload_ops)))
+      sys.exit(1)
+  plan_only = args.verify or args.workload        # the tree exists, it is only regenerated in memory.
+  if plan_only:
+    mode = '--verify' if args.verify else '--workload'
+    if not os.path.isdir(args.dir):
+      print("ERROR: %s: %s is not a directory." % (mode, args.dir))
+      sys.exit(1)
+    if args.resume:
+      print("ERROR: %s and --resume do not mix." % mode)
+      sys.exit(1)
+    if not args.manifest and not args.load_config:
+      args.load_config = os.path.join(args.dir, os.path.basename(os.path.abspath(args.dir))+'.conf')
+      if not os.path.exists(args.load_config):
+        print("ERROR: %s: needs --manifest FILE, or -L CONFIG_FILE, or %s." % (mode, args.load_config))
+        sys.exit(1)
+  if args.resume:
+    try:
+      ckpt = json.load(open(os.path.join(args.dir, ckptfile)))
+    except OSError as e:
+      print("ERROR: --resume: cannot read %s: %s" % (os.path.join(args.dir, ckptfile), e.strerror))
+      sys.exit(1)
+    conf = dict(ckpt['conf'])
+    # run options of the interrupted run, unless given again.
+    for k, v in ckpt['args'].items():
+      if getattr(args, k, None) is None: setattr(args, k, v)
+  elif args.load_config:
+    conf = json.load(open(args.load_config))
+    # config files of older versions
+    conf.setdefault('stream', 'legacy')
+    conf.setdefault('size_dist', 'uniform')
+    conf.setdefault('body', 'data')
+  conf['run'] = conf_run
+
+  if args.engine         is None: args.engine         = 'path'
+  if args.writer         is None: args.writer         = 'simple'
+  if args.writer_threads is None: args.writer_threads = 16
+
+  if args.maxfiles            is not None: conf['maxfiles']            = args.maxfiles
+  if args.seed                is not None: conf['seed']                = args.seed
+  if args.folder_ratio        is not None: conf['folder_ratio']        = args.folder_ratio
+  if args.max_entries_per_dir is not None: conf['max_entries_per_dir'] = args.max_entries_per_dir
+  if args.min_entries_per_dir is not None: conf['min_entries_per_dir'] = args.min_entries_per_dir
+  if args.max_name_len        is not None: conf['max_name_len']        = args.max_name_len
+  if args.min_name_len        is not None: conf['min_name_len']        = args.min_name_len
+  if args.max_body_len        is not None: conf['max_body_len']        = args.max_body_len
+  if args.min_body_len        is not None: conf['min_body_len']        = args.min_body_len
+  if args.corpus_size         is not None: conf['corpus_size']         = args.corpus_size
+  if args.suffix              is not None: conf['suffix']              = args.suffix
+  if args.jobs is not None and not args.workload and conf['stream'] == 'legacy':
+    conf['stream'] = 'perdir'        # -j needs per-directory seeding, 'numpy' has it already.
+  if args.stream              is not None: conf['stream']              = args.stream
+  if args.size_dist           is not None: conf['size_dist']           = args.size_dist
+  if args.body                is not None: conf['body']                = args.body
+
+  dist = conf['size_dist']
+  try:
+    if dist.startswith('hist:'):
+      # store the histogram itself, so that -L does not need the file.
+      conf['size_hist'] = read_size_hist(dist[5:])
+      conf['size_dist'] = 'hist'
+    size_dist = parse_size_dist(conf)
+  except ValueError as e:
+    print("ERROR: size_dist '%s': %s. Try uniform, lognormal:MEDIAN:SIGMA, pareto:ALPHA or hist:FILE." % (dist, e))
+    sys.exit(1)
+  if conf['body'] == 'fallocate' and not hasattr(os, 'posix_fallocate'):
+    print("ERROR: --body fallocate is not supported on %s, try sparse." % sys.platform)
+    sys.exit(1)
+
+  jobs = max(1, args.jobs or 1)
+  workload_jobs = jobs
+  if plan_only:
+    # regenerate in this process, only reading the tree.
+    jobs = 1
+    args.engine = 'path'
+    args.checkpoint = 0
+  if archive:
+    # one ordered stream, populated in this process. -j still selects stream 'perdir'.
+    jobs = 1
+    args.engine = 'path'
+    args.writer = archive
+    args.checkpoint = 0
+  if args.dav:
+    # mkdirs are synchronous in this process, files go to the connection threads of the writer.
+    jobs = 1
+    args.engine = 'path'
+    args.writer = 'dav'
+    args.checkpoint = 0
+  conf_run['jobs'] = jobs
+  if conf['stream'] not in ('legacy', 'perdir', 'numpy'):
+    print("ERROR: unknown stream '%s'. Known: legacy, perdir, numpy." % conf['stream'])
+    sys.exit(1)
+  if conf['stream'] == 'legacy' and jobs > 1:
+    print("ERROR: -j needs stream perdir or numpy.")
+    sys.exit(1)
+  if conf['stream'] == 'numpy':
+    try:
+      import numpy
+    except ImportError:
+      print("ERROR: stream 'numpy' needs the numpy module. Try: pip install numpy")
+      sys.exit(1)
+  conf_run['engine'] = args.engine
+  conf_run['writer'] = args.writer
+  if args.rate or args.rate_mb:
+    conf_run['rate'] = args.rate
+    conf_run['rate_mb'] = args.rate_mb
+  if args.engine == 'dirfd' and not (os.open in os.supports_dir_fd and os.mkdir in os.supports_dir_fd):
+    print("ERROR: --engine dirfd is not supported on %s." % sys.platform)
+    sys.exit(1)
+  if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+    print("ERROR: -j needs the 'fork' start method, which is not available on %s." % sys.platform)
+    sys.exit(1)
+
+  try:
+    normalize_conf(conf, print)
+  except ValueError as e:
+    print("ERROR: %s." % e)
+    sys.exit(1)
+
+  if ckpt and ckpt['conf'] != dict((k, v) for k, v in conf.items() if k != 'run'):
+    print("ERROR: --resume: options differ from the checkpoint. Run with --resume and the same options as before, or none.")
+    sys.exit(1)
+
+  conffile = os.path.basename(os.path.abspath(args.dir))+'.conf'
+
+  if not plan_only and not archive and not args.dav and not args.delete:
+    os.makedirs(args.dir, exist_ok=True)
+  if not archive and not args.dav:
+    os.chdir(args.dir)      # or explode.
+
+
+  if args.testonly:
+    testdepth = 10_000
+    testwidth = 20_000
+    testnamelen = 10_000
+    testxattr = 1 << 24
+    testlinks = 100_000
+    testfolder = "_t"
+    if sys.platform == 'win32':
+      testdepth = 1_000           # Windows 10 on NTFS with LongPathsEnabled=1, 10_000 takes ages.
+      testwidth = 2_000           # Windows 10 on NTFS is just dead slow.
+      testlinks = 2_000
+    fname = "123456789_123456789_123456789_123456789_123456789"
+
+    def trying(f, *a):
+      try:
+        f(*a)
+        return True
+      except OSError:
+        return False
+
+    # Each probe works in a folder of its own, and returns (profile entries, report line).
+    # They are independent, and run in parallel.
+
+    def probe_name_file(top):
+      def ok(l):
+        if not trying(lambda: open(top + "/" + "f" * l, "w").close()):
+          return False
+        os.unlink(top + "/" + "f" * l)
+        return True
+      l = search_limit(ok, testnamelen)
+      return {'name_max_file': l}, "open() with a long file name:           %s namelen=%d, pathlen=%d" % ('limit' if l < testnamelen else 'done ', l, len(top) + 1 + l)
+
+    def probe_name_dir(top):
+      def ok(l):
+        if not trying(os.mkdir, top + "/" + "f" * l):
+          return False
+        os.rmdir(top + "/" + "f" * l)
+        return True
+      l = search_limit(ok, testnamelen)
+      return {'name_max_dir': l}, "mkdir() with one long folder name:      %s namelen=%d, pathlen=%d" % ('limit' if l < testnamelen else 'done ', l, len(top) + 1 + l)
+
+    def probe_depth(top, name, key, what):
+      # makedirs() creates one level after the other, and leaves the ones it could create.
+      # So the chain only grows, and each probe below the limit is just a walk.
+      path = lambda d: top + ("/" + name) * d
+      d = search_limit(lambda d: trying(os.makedirs, path(d), 0o777, True), testdepth)
+      return {key: d, key.replace('depth', 'path_max'): len(path(d))}, \
+        ("makedirs() with %s folder names:" % what).ljust(40) + "%s depth=%d, pathlen=%d" % ('limit' if d < testdepth else 'done ', d, len(path(d)))
+
+    def probe_depth_dirfd(top):
+      # same as --engine dirfd: only ever one name relative to an open directory. Also cleans up that way,
+      # rmtree() would need one file descriptor per level. Each level is one mkdir, no bisection needed.
+      fd = os.open(top, O_DIR)
+      for d in range(testdepth):
+        try:
+          os.mkdir(fname, dir_fd=fd)
+          sub = os.open(fname, O_DIR, dir_fd=fd)
+        except OSError:
+          break
+        os.close(fd)
+        fd = sub
+      else:
+        d = testdepth
+      pathlen = len(top) + d*(len(fname)+1)
+      rmchain(fd, fname)
+      return {'depth_dirfd': d, 'path_max_dirfd': pathlen}, \
+        "mkdir(dir_fd=) with long folder names:  %s depth=%d, pathlen=%d" % ('limit' if d < testdepth else 'done ', d, pathlen)
+
+    def probe_siblings(top):
+      for d in range(testwidth):
+        if not trying(os.mkdir, top + ("/f_%08d" % d)):
+          break
+      else:
+        d = testwidth
+      return {'siblings': d}, "mkdir() with many sibling folders:      %s number_of_siblings=%d" % ('limit' if d < testwidth else 'done ', d)
+
+    def probe_xattr(top):
+      path = top + "/x"
+      open(path, "w").close()
+      if not trying(os.setxattr, path, 'user.randfiles', b'x'):
+        return {'xattr_max': None}, "setxattr() with a large value:          not supported"
+      n = search_limit(lambda n: trying(os.setxattr, path, 'user.randfiles', bytes(n)), testxattr)
+      return {'xattr_max': n}, "setxattr() with a large value:          %s size=%d" % ('limit' if n < testxattr else 'done ', n)
+
+    def probe_links(top):
+      path = top + "/l"
+      open(path, "w").close()
+      for n in range(1, testlinks):
+        if not trying(os.link, path, path + "_%d" % n):
+          break
+      else:
+        n = testlinks
+      return {'link_max': n}, "link() to one file:                     %s links=%d" % ('limit' if n < testlinks else 'done ', n)
+
+    def probe_create(top):
+      """ Create latency as a function of the directory size, in buckets of powers of two.
+          Alone, so that the other probes do not disturb it. The rate and statvfs() give the time to run out of inodes.
+      """
+      hists = {}
+      start = time.time()
+      for n in range(testwidth):
+        t = time.perf_counter()
+        try:
+          os.close(os.open(top + ("/f_%08d" % n), O_CREATE, 0o666))
+        except OSError:
+          break
+        hists.setdefault(1 << n.bit_length(), Histogram()).add(time.perf_counter() - t)
+      else:
+        n = testwidth
+      rate = n / max(time.time() - start, 1e-9)
+      prof = {'create_per_s': round(rate, 1), 'create_latency': [dict(h.summary(), entries_below=k) for k, h in sorted(hists.items())]}
+      lines = ["open(O_CREAT) in a growing folder:       %d files/s, p50 ms by size: %s" %
+               (rate, ' '.join('<%d:%g' % (k, h.summary()['p50_ms']) for k, h in sorted(hists.items()) if k >= 1024 or k == 1))]
+      try:
+        st = os.statvfs('.')
+        prof.update({'inodes_total': st.f_files, 'inodes_free': st.f_ffree})
+        if st.f_files:
+          prof['inodes_exhausted_s'] = round(st.f_ffree / max(rate, 1e-9), 1)
+          lines.append("inodes:                                 %d of %d free, exhausted in %d seconds at that rate" % (st.f_ffree, st.f_files, prof['inodes_exhausted_s']))
+        else:
+          lines.append("inodes:                                 not limited")
+      except (AttributeError, OSError):
+        pass          # no statvfs on windows.
+      return prof, '\n'.join(lines)
+
+    probes = [probe_name_file, probe_name_dir, lambda top: probe_depth(top, fname, 'depth_long', 'long'),
+              lambda top: probe_depth(top, 'f', 'depth_short', 'short'), probe_siblings, probe_links]
+    if os.mkdir in os.supports_dir_fd:
+      probes.append(probe_depth_dirfd)
+    if hasattr(os, 'setxattr'):
+      probes.append(probe_xattr)
+
+    sys.setrecursionlimit(testdepth+20)          # makedirs() recurses once per missing level.
+    os.makedirs(testfolder, exist_ok=False)       # explode early, if another test is running here.
+    tops = [testfolder + "/%d" % i for i in range(len(probes) + 1)]
+    for top in tops:
+      os.mkdir(top)
+    profile = {'dir': os.getcwd(), 'platform': sys.platform, 'when': time.ctime(), '__version__': __version__,
+               'testdepth': testdepth, 'testwidth': testwidth, 'testnamelen': testnamelen, 'testxattr': testxattr, 'testlinks': testlinks}
+    with concurrent.futures.ThreadPoolExecutor(len(probes)) as pool:
+      results = list(pool.map(lambda p, top: p(top), probes, tops))
+    results.append(probe_create(tops[-1]))
+    for prof, line in results:
+      profile.update(prof)
+      print(line)
+    delete_tree(testfolder)
+    os.rmdir(testfolder)
+
+    proffile = os.path.basename(os.path.abspath(args.dir)) + '.fsprofile'
+    o = open(proffile, "w")
+    print(json.dumps(profile, sort_keys=True, indent=4), file=o)
+    o.close()
+    print("... %s written." % (args.dir + '/' + proffile))
+    sys.exit(0)
+
+
+  if args.verify and args.manifest:
+    sys.exit(1 if verify(*load_manifest(args.manifest), threads=args.threads) else 0)
+
+
+  if args.delete:
+    root = os.getcwd()
+    print("Deleting %s, %d entries at the top level (%s)." % (root, len(os.listdir('.')), made_by or '--force'))
+    sys.stdout.flush()
+    start = time.time()
+    files, dirs, errors, unlink_hist, rmdir_hist = delete_tree('.', args.threads, args.manifest)
+    os.chdir('..')
+    try:
+      os.rmdir(root)
+      dirs += 1
+    except OSError as e:
+      print("ERROR: --delete: %s: %s" % (root, e.strerror))
+      errors += 1
+    elapsed = max(time.time() - start, 1e-9)
+    print("deleted_files:", files)
+    print("deleted_dirs: ", dirs)
+    print("errors:       ", errors)
+    print("deletes/s:    ", int((files + dirs) / elapsed))
+    for op, h in (('unlink', unlink_hist), ('rmdir', rmdir_hist)):
+      if h.n:
+        print("%-13s" % (op + ' ms:'), "p50 %(p50_ms)g  p90 %(p90_ms)g  p99 %(p99_ms)g  max %(max_ms)g  (%(count)d)" % h.summary())
+    sys.exit(1 if errors else 0)
+
+
+  random.seed(conf['seed'])
+  corpus = make_corpus(random)
+  legacy_state = random.getstate()
+  # File bodies are sliced from the bytes, without a copy and without encoding. Names need str.
+  corpus_bytes = memoryview(corpus.encode())
+
+
+  if args.workload and args.manifest:
+    sys.exit(1 if run_workload(load_manifest(args.manifest)[0]) else 0)
+
+  if plan_only:
+    # the tree exists, regenerate its manifest entries in memory, by path.
+    start_time = time.time()
+    expected = {}
+    for e in tree_entries(random):
+      if e.kind == 'd':
+        expected[e.path] = ('d', '-', '-')
+      elif args.verify:
+        expected[e.path] = tuple(manifest_file('./' + e.path, e.body).split('\t', 3)[:3])
+      else:
+        expected[e.path] = ('f', str(e.size), '-')
+    print("%d entries regenerated in %.1f seconds." % (len(expected), time.time() - start_time))
+    if args.verify:
+      sys.exit(1 if verify(expected, manifest_hash, threads=args.threads) else 0)
+    sys.exit(1 if run_workload(expected) else 0)
+
+
+  sched = Schedule(ahead=2 * jobs)
+  total_files = 0
+  total_dirs = 0
+  emerg_dirs = 0
+  mkdir_err = 0
+  open_err = 0
+  max_depth = 0
+  max_queued = 0
+  total_bytes = 0
+  writer_errors = 0       # of the threads writer, before a --resume
+  resumed = 0
+  dirfds = None
+  manifest = None
+  rng_s = 0.0
+  worker_ops = {}         # pid -> latency histograms of a -j worker, cumulative.
+  stats_out = None
+  start_time = time.time()
+
+  if ckpt:
+    (total_files, total_dirs, emerg_dirs, mkdir_err, open_err, max_depth, max_queued, total_bytes, planned, writer_errors, done) = ckpt['counters']
+    if conf['stream'] == 'legacy':
+      planned = total_files + total_dirs
+    sched = Schedule(queue_from_paths(ckpt['queue']), zip(queue_from_paths(p for p, c in ckpt['pending']), (c for p, c in ckpt['pending'])),
+                     planned, done, 2 * jobs)
+    start_time -= ckpt['elapsed']
+    resumed = ckpt['resumed'] + 1
+    if ckpt['random']:
+      random.setstate((ckpt['random'][0], tuple(ckpt['random'][1]), ckpt['random'][2]))
+    print("Resuming at %d files, %d dirs queued." % (total_files, len(sched.dirs) + len(sched.pending)))
+  if args.manifest and not plan_only:
+    manifest = Manifest(args.manifest, ckpt['manifest_offset'] if ckpt else None)
+  conf_run['resumed'] = resumed
+  last_ckpt = time.time()
+  if args.stats:
+    stats_out = open(args.stats, 'a')
+  last_stats = {'time': time.time(), 'entries': total_files + total_dirs, 'bytes': total_bytes, 'ops': op_snapshot()}
+
+
+  if conf['stream'] == 'legacy':
+    w = get_writer()
+    p = get_pacer()
+    if args.engine == 'dirfd':
+      dirfds = DirFds(before_close=w.drain)
+    for dirr, kind, f in sched.legacy(random):
+      if stats_due():
+        emit_stats()
+      if kind == 'begin':
+        dir = dirfds.get(dirr) if dirfds else dir_path(dirr)
+        if dirr[2] > max_depth:
+          max_depth = dirr[2]
+        seen = set() if resumed else None
+        if manifest:
+          dirp = dir_path(dirr) if dirfds else dir
+          lines = []
+      elif kind == 'f':
+        if seen is not None:
+          seen.add(f[0])
+        if p:
+          p.take(len(f[1]))
+        try:
+          w.file(dir, f[0], f[1])
+        except:
+          continue
+        sched.created(dirr, kind, f)
+        total_files += 1
+        total_bytes += len(f[1])
+        if manifest:
+          lines.append(manifest_file(dirp + '/' + f[0], f[1]))
+      elif kind != 'end':
+        if p and kind == 'd':
+          p.take(0)
+        try:
+          if seen is not None:
+            mkdir_seen(w.mkdir, dir, f, seen)
+          else:
+            w.mkdir(dir, f)
+        except:
+          continue
+        sched.created(dirr, kind, f)
+        total_dirs += 1
+        if kind == 'e':
+          emerg_dirs += 1
+        if manifest:
+          lines.append(manifest_dir(dirp + '/' + f))
+      else:
+        if manifest:
+          w.drain()
+          manifest.add(manifest_created(lines, w))
+        max_queued = max(max_queued, len(sched.dirs))
+        print("%d files done. depth: %d" % (total_files, max_depth))
+        if checkpoint_due() and not sched.done:
+          w.drain()
+          checkpoint(random.getstate())
+
+
+  if conf['stream'] != 'legacy':
+    # The schedule walks the directories in the same breadth-first order for any number of workers,
+    # and decides how many entries each directory gets. Only the population runs in parallel.
+    # Results are consumed in submission order, so the queue order never depends on timing.
+    if stats_out:
+      progress = multiprocessing.Array('q', 3)
+    get_pacer()
+    pool = multiprocessing.get_context('fork').Pool(jobs) if jobs > 1 else None
+    if args.engine == 'dirfd':
+      dirfds = DirFds()
+    results = deque()
+    for dirr, kind, v in sched.perdir():
+      if kind == 'populate':
+        dir = dir_path(dirr)
+        if dirr[2] > max_depth:
+          max_depth = dirr[2]
+        results.append(pool.apply_async(populate_dir, (dir, v)) if pool else populate_dir(dir, v, True))
+      elif kind == 'populated':
+        res = results.popleft()
+        while pool and stats_out and not res.ready():
+          res.wait(last_stats['time'] + args.stats_interval - time.time())
+          if stats_due():
+            emit_stats()
+        subdirs, f, d, oe, me, b, lines, rs, (pid, hists) = res.get() if pool else res
+        if progress:
+          progress_add(-f, -d, -b)
+        rng_s += rs
+        worker_ops[pid] = hists
+        if manifest:
+          manifest.add(lines)
+        sched.populated(dirr, subdirs)
+        total_files += f
+        total_dirs += d
+        open_err += oe
+        mkdir_err += me
+        total_bytes += b
+        seen = set(subdirs) if resumed else None
+      elif kind == 'e':
+        dir = dir_path(dirr)
+        try:
+          if seen is not None:
+            mkdir_seen(get_writer().mkdir, dirfds.get(dirr) if dirfds else dir, v, seen)
+          else:
+            get_writer().mkdir(dirfds.get(dirr) if dirfds else dir, v)
+        except:
+          continue
+        sched.created(dirr, kind, v)
+        total_dirs += 1
+        emerg_dirs += 1
+        if manifest:
+          manifest.add([manifest_dir(dir + '/' + v)])
+      else:
+        max_queued = max(max_queued, len(sched.dirs))
+        print("%d files done. depth: %d" % (total_files, max_depth))
+        if stats_due():
+          emit_stats()
+        if checkpoint_due():
+          checkpoint()
+
+    if pool:
+      pool.close()
+      pool.join()
+
+  if dirfds:
+    dirfds.close()
+  if writer:
+    writer.close()
+    # files were counted when queued, the threads writer only knows about its failures now.
+    if conf['stream'] == 'legacy':
+      total_files -= writer_errors + writer.errors
+      open_err += writer_errors + writer.errors
+  elapsed = time.time() - start_time
+  if manifest:
+    manifest.close()
+    print("... %s written." % args.manifest)
+  if not archive and not args.dav and os.path.exists(ckptfile):
+    os.unlink(ckptfile)
+
+
+  print("total_files: ", total_files)
+  print("total_dirs:  ", total_dirs)
+  print("max_depth:   ", max_depth)
+  print("emerg_dirs:  ", emerg_dirs)
+  print("mkdir_err:   ", mkdir_err)
+  print("open_err:    ", open_err)
+  print("seed:        ", conf['seed'])
+  print("writer:      ", args.writer)
+  print("files/s:     ", int((total_files + total_dirs) / max(elapsed, 1e-9)))
+  print("MB/s:        ", round(total_bytes / max(elapsed, 1e-9) / 1e6, 2))
+  print("peak_rss_kb: ", peak_rss_kb())
+  op_total = op_totals()
+  for op, h in op_total.items():
+    if h.n:
+      print("%-13s" % (op + ' ms:'), "p50 %(p50_ms)g  p90 %(p90_ms)g  p99 %(p99_ms)g  max %(max_ms)g  (%(count)d)" % h.summary())
+  syscall_s = sum(h.sum for h in op_total.values())
+  print("rng_s:       ", round(rng_s + sched.rng_s, 3))
+  print("syscall_s:   ", round(syscall_s, 3))
+  if stats_out:
+    emit_stats()
+    stats_out.close()
+
+  conf['run']['result'] = {
+    'total_files': total_files,
+    'total_dirs': total_dirs,
+    'max_depth': max_depth,
+    'emerg_dirs': emerg_dirs,
+    'mkdir_err': mkdir_err,
+    'open_err': open_err,
+    'max_queued_dirs': max_queued,
+    'total_bytes': total_bytes,
+    'elapsed_s': round(elapsed, 3),
+    'files_per_s': round((total_files + total_dirs) / max(elapsed, 1e-9), 1),
+    'mb_per_s': round(total_bytes / max(elapsed, 1e-9) / 1e6, 3),
+    'peak_rss_kb': peak_rss_kb(),
+    'peak_rss_kb_workers': peak_rss_kb('children'),
+    'rng_s': round(rng_s + sched.rng_s, 3),
+    'syscall_s': round(syscall_s, 3),
+    'latency': dict((op, h.summary()) for op, h in op_total.items() if h.n),
+  }
+
+  if archive:
+    # the .conf file goes into the archive, where it would be in DIR.
+    w = get_writer()
+    w.file('.', conffile, memoryview((json.dumps(conf, sort_keys=True, indent=4) + '\n').encode()))
+    w.finish()
+    if target != '-':
+      archive_out.close()
+    print("... %s written." % (target if target != '-' else 'stdout'))
+  elif args.dav:
+    errors = writer.errors
+    writer.file('.', conffile, memoryview((json.dumps(conf, sort_keys=True, indent=4) + '\n').encode()))
+    writer.finish()
+    where = '%s://%s%s/%s' % (dav_url.scheme, dav_url.netloc.rsplit('@', 1)[-1], writer.base, conffile)   # without the password.
+    if writer.errors > errors:
+      print("ERROR: --dav: PUT %s failed." % where)
+      sys.exit(1)
+    print("... %s written." % where)
+  else:
+    o = open(conffile, "w")
+    print(json.dumps(conf, sort_keys=True, indent=4), file=o)
+    o.close()
+    print("... %s written." % (args.dir + '/' + conffile))
 
@@ -0,0 +1,68 @@
+#! /usr/bin/python3
+#
+# Regression tests for randfiles.py. Run with:
+#   python3 -m pytest tools/randfiles          or          python3 tools/randfiles/test_randfiles.py
+
+import os, sys, hashlib, tempfile, subprocess, unittest
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+import randfiles
+
+
+def tree_digest(entries):
+  # entries: {path: (kind, bytes)} of a tree. The digest does not depend on their order.
+  h = hashlib.sha256()
+  for path in sorted(entries):
+    kind, data = entries[path]
+    h.update(('%s\t%d\t%s\t%s\n' % (kind, len(data), hashlib.sha256(data).hexdigest(), path)).encode())
+  return h.hexdigest()
+
+
+def disk_entries(top):
+  # the tree below top, without the .conf file.
+  entries = {}
+  for dir, dirs, files in os.walk(top):
+    rel = os.path.relpath(dir, top)
+    for d in dirs:
+      entries[os.path.normpath(os.path.join(rel, d))] = ('d', b'')
+    for f in files:
+      if not f.endswith('.conf'):
+        with open(os.path.join(dir, f), 'rb') as fd:
+          entries[os.path.normpath(os.path.join(rel, f))] = ('f', fd.read())
+  return entries
+
+
+class LegacyStreamTest(unittest.TestCase):
+  """ Stream 'legacy' makes the same trees as randfiles.py v0.7, the digests are of trees written by v0.7. """
+  cases = [
+    # large min_entries_per_dir, one letter names: many collisions, most directories get fewer entries than that.
+    ('-m 3000 -e 200 --min_entries_per_dir 200 -n 1 --min_name_len 1 -f 90 -S q',
+     {'maxfiles': 3000, 'max_entries_per_dir': 200, 'min_entries_per_dir': 200, 'max_name_len': 1, 'min_name_len': 1,
+      'folder_ratio': 90, 'seed': 'q'},
+     'afe4caf30d4f47e25e983b5a61290dd5e61890c73756645c2937eaa997b882eb'),
+    ('-m 5000 -e 100 --min_entries_per_dir 80 -f 5 -S r',
+     {'maxfiles': 5000, 'max_entries_per_dir': 100, 'min_entries_per_dir': 80, 'folder_ratio': 5, 'seed': 'r'},
+     'bcdd2700fc35c8cc6122faa1e8ac1ff8558ed6cbee36131cea319406d1c41cb1'),
+  ]
+
+  def test_script(self):
+    for opts, c, digest in self.cases:
+      with self.subTest(opts=opts), tempfile.TemporaryDirectory() as tmp:
+        subprocess.run([sys.executable, os.path.join(here, 'randfiles.py')] + opts.split() + ['t'],
+                       cwd=tmp, check=True, stdout=subprocess.DEVNULL)
+        self.assertEqual(tree_digest(disk_entries(os.path.join(tmp, 't'))), digest)
+
+  def test_tree_entries(self):
+    for opts, c, digest in self.cases:
+      with self.subTest(opts=opts):
+        rng = randfiles.setup(c)
+        for r in (rng, None, None):     # with the generator of setup(), and twice with one of its own.
+          entries = {}
+          for e in randfiles.tree_entries(r):
+            entries[os.path.normpath(e.path)] = (e.kind, b''.join(randfiles.body_chunks(e.body)) if e.kind == 'f' else b'')
+          self.assertEqual(tree_digest(entries), digest)
+
+
+if __name__ == '__main__':
+  unittest.main()